@@ -1,14 +1,73 @@
-import os
+import gzip
 import json
+import base64
+import time
+import random
+import hashlib
+import threading
+import http.client
+import urllib.error
 import urllib.request
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import *
 
+import metrics
+import cachedb
+
 use_cache: bool = True
 user_agent: Dict[str, str] = {"User-Agent": "Runelite Wiki Scraper/1.0 (+abex@runelite.net)"}
+api_host: str = "oldschool.runescape.wiki"
+# how many requests may be in flight at once, across all threads
+max_workers: int = 8
+# seconds an attempt may take, connecting and reading the whole response, before it is given up
+timeout: float = 60
+# seconds a request may take including its retries and the waits between them
+deadline: float = 600
+# how many times a request is retried after a timeout, connection error, 429, 5xx or maxlag
+max_retries: int = 6
+# retries wait a random time up to backoff_base * 2 ** attempt seconds, capped at backoff_max
+backoff_base: float = 1.0
+backoff_max: float = 120.0
+# ask the wiki to refuse requests while its replicas lag more than this many seconds, None to not ask
+maxlag: Optional[int] = 5
+# check stored pages against their current revision ID before reusing them
+revalidate: bool = True
+# print the URL of every request; requests are always counted in the run report
+verbose: bool = False
+CATEGORY_PREFIX: str = "Category:"
+
+_local = threading.local()
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+# sends a request path to the wiki and returns (status, reason, headers, body), None for HTTPS;
+# see recording and replaying
+transport: Optional[Callable[[str], Tuple[int, str, Any, bytes]]] = None
+# the cassette and latency being replayed, which worker processes replay too
+_replay: Optional[Tuple[str, float]] = None
+
+# adaptive request limit: halved when the wiki signals load, grown back by one per limit successes
+_limit: float = 0
+_in_flight: int = 0
+_limit_changed = threading.Condition(_lock)
+# the pages read this run by their own title; the rest stay in cachedb until asked for
+_page_store: Optional[Dict[str, Dict[str, Any]]] = None
+# titles of the pages fetched this run, not stored in cachedb yet
+_dirty: Set[str] = set()
+# normalized titles whose page in the store is current, and titles of missing pages
+_fresh: Set[str] = set()
+_missing: Set[str] = set()
+_categories: Dict[str, List[str]] = {}
+# the title of the page each normalized title leads to, as the wiki answered this run
+_aliases: Dict[str, str] = {}
+# the same from earlier runs, only trusted where the page is not revalidated
+_stored_aliases: Dict[str, str] = {}
 
 def get_wiki_api(args: Dict[str, str], continueKey: str) -> Iterator[Any]:
 	args["format"] = "json"
+	if maxlag is not None:
+		args["maxlag"] = str(maxlag)
 	batches = []
 	if 'titles' in args:
 		titles = args.get("titles").split('|')
@@ -16,13 +75,18 @@ def get_wiki_api(args: Dict[str, str], continueKey: str) -> Iterator[Any]:
 	elif 'pageids' in args:
 		pageids = args.get("pageids").split('|')
 		batches = [pageids[i:i+50] for i in range(0, len(pageids), 50)]
-	if batches:
+	if len(batches) > 1:
+		# each batch is its own continue chain, so the chains can run side by side
+		chains = []
 		for batch in batches:
+			chain = dict(args)
 			if 'titles' in args:
-				args["titles"] = "|".join(batch)
+				chain["titles"] = "|".join(batch)
 			elif 'pageids' in args:
-				args["pageids"] = "|".join(batch)
-			for js in get_wiki_api_helper(args, continueKey):
+				chain["pageids"] = "|".join(batch)
+			chains.append(chain)
+		for results in _get_executor().map(lambda chain: list(get_wiki_api_helper(chain, continueKey)), chains):
+			for js in results:
 				yield js
 	else:
 		for js in get_wiki_api_helper(args, continueKey):
@@ -30,52 +94,559 @@ def get_wiki_api(args: Dict[str, str], continueKey: str) -> Iterator[Any]:
 
 def get_wiki_api_helper(args: Dict[str, str], continueKey: str) -> Iterator[Any]:
 	while True:
-		url = "https://oldschool.runescape.wiki/api.php?" + urllib.parse.urlencode(args)
-		print("Grabbing " + url)
-		with urllib.request.urlopen(urllib.request.Request(url, headers=user_agent)) as raw:
-			js = json.load(raw)
+		path = "/api.php?" + urllib.parse.urlencode(args)
+		if verbose:
+			print("Grabbing https://" + api_host + path)
+		js = json.loads(fetch(path))
 		yield js
 		if "continue" in js:
 			args[continueKey] = js["continue"][continueKey]
 		else:
 			return
 
-def query_category(category_name: str) -> Dict[str, str]:
+def fetch(path: str) -> bytes:
 	"""
-	query_category returns a dict of page title to page wikitext
-	you can then use mwparserfromhell to parse the wikitext into
-	an ast
+	fetch GETs a path on the wiki over a keep-alive connection owned by
+	the calling thread, holding one of the request slots. Timeouts,
+	connection errors, 429, 5xx and maxlag responses are retried with
+	jittered exponential backoff, waiting at least as long as the wiki's
+	Retry-After asks, and shrink the number of slots while they last.
+	Retries stop once the request has taken deadline seconds
+	"""
+	end = time.monotonic() + deadline
+	for attempt in range(max_retries + 1):
+		error: Optional[Exception] = None
+		status, reason, headers, body = 0, "", http.client.HTTPMessage(), b""
+		with _request_slot() as throttle:
+			# read by _request, so an attempt never runs past the request's deadline
+			_local.deadline = end
+			try:
+				with metrics.timer("http.seconds"):
+					status, reason, headers, body = (transport or _request)(path)
+				metrics.count("http.requests")
+				metrics.count("http.bytes", len(body))
+			except (OSError, http.client.HTTPException) as e:
+				error = e
+			lagged = headers.get("MediaWiki-API-Error") == "maxlag"
+			overloaded = lagged or status in (429, 503)
+			if overloaded:
+				metrics.count("http.throttled")
+				throttle()
+		retryable = error is not None or overloaded or status >= 500
+		if not retryable:
+			break
+		delay = random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+		retry_after = headers.get("Retry-After")
+		if retry_after is not None and retry_after.strip().isdigit():
+			delay = max(delay, float(retry_after))
+		if attempt == max_retries or time.monotonic() + delay >= end:
+			if error is not None:
+				raise error
+			break
+		metrics.count("http.retries")
+		print(f"Retrying https://{api_host}{path} in {delay:.1f}s after {error or ('maxlag' if lagged else status)}")
+		time.sleep(delay)
+
+	if status != 200:
+		raise urllib.error.HTTPError("https://" + api_host + path, status, reason, headers, None)
+	if headers.get("Content-Encoding") == "gzip":
+		body = gzip.decompress(body)
+	if lagged:
+		raise urllib.error.HTTPError("https://" + api_host + path, status, "maxlag", headers, None)
+	return body
+
+def _request(path: str) -> Tuple[int, str, Any, bytes]:
+	end = min(time.monotonic() + timeout, getattr(_local, "deadline", float("inf")))
+	for attempt in range(2):
+		conn = getattr(_local, "conn", None)
+		if conn is None:
+			conn = _local.conn = http.client.HTTPSConnection(api_host)
+		try:
+			conn.timeout = _remaining(end)
+			conn.request("GET", path, headers={**user_agent, "Accept-Encoding": "gzip"})
+			# kept, since conn drops its socket once a response asks to close the connection
+			sock = conn.sock
+			sock.settimeout(_remaining(end))
+			with conn.getresponse() as raw:
+				chunks = []
+				while True:
+					# one socket read per chunk, so a response trickling in can't outlast end
+					sock.settimeout(_remaining(end))
+					chunk = raw.read1(65536)
+					if not chunk:
+						break
+					chunks.append(chunk)
+				return raw.status, raw.reason, raw.headers, b"".join(chunks)
+		except (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionResetError, BrokenPipeError):
+			# the server dropped the idle keep-alive connection, reconnect once
+			conn.close()
+			_local.conn = None
+			if attempt > 0:
+				raise
+		except BaseException:
+			conn.close()
+			_local.conn = None
+			raise
+	raise AssertionError()
+
+def _remaining(end: float) -> float:
+	"""_remaining returns the seconds left until end, raising TimeoutError once it has passed"""
+	left = end - time.monotonic()
+	if left <= 0:
+		raise TimeoutError("request deadline passed")
+	return left
+
+@contextmanager
+def recording(file_name: str) -> Iterator[None]:
+	"""
+	recording stores every response received while the block runs, keyed
+	by request path, in a gzipped JSON cassette that replaying can serve
+	"""
+	global transport
+	previous = transport
+	responses: Dict[str, List[Dict[str, Any]]] = {}
+
+	def record(path: str) -> Tuple[int, str, Any, bytes]:
+		status, reason, headers, body = (previous or _request)(path)
+		with _lock:
+			responses.setdefault(path, []).append({
+				"status": status,
+				"reason": reason,
+				"headers": list(headers.items()),
+				"body": base64.b64encode(body).decode("ascii"),
+			})
+		return status, reason, headers, body
+
+	transport = record
+	try:
+		yield
+	finally:
+		transport = previous
+		with gzip.open(file_name, "wt", encoding="utf-8") as fi:
+			json.dump(responses, fi)
+
+@contextmanager
+def replaying(file_name: str, latency: float = 0.0) -> Iterator[None]:
+	"""
+	replaying answers requests from a cassette written by recording instead
+	of the wiki, waiting latency seconds per request. A path requested more
+	often than it was recorded gets its last response again; a path that
+	was never recorded raises a KeyError
+	"""
+	global transport, _replay
+	previous, previous_replay = transport, _replay
+	transport, _replay = _replayer(file_name, latency), (file_name, latency)
+	try:
+		yield
+	finally:
+		transport, _replay = previous, previous_replay
+
+def _replayer(file_name: str, latency: float) -> Callable[[str], Tuple[int, str, Any, bytes]]:
+	"""_replayer returns a transport answering from the cassette in file_name"""
+	with gzip.open(file_name, "rt", encoding="utf-8") as fi:
+		responses: Dict[str, List[Dict[str, Any]]] = json.load(fi)
+	served: Dict[str, int] = {}
+
+	def replay(path: str) -> Tuple[int, str, Any, bytes]:
+		with _lock:
+			if path not in responses:
+				raise KeyError(f"{path} is not in {file_name}")
+			index = served[path] = served.get(path, -1) + 1
+			response = responses[path][min(index, len(responses[path]) - 1)]
+		if latency:
+			time.sleep(latency)
+		headers = http.client.HTTPMessage()
+		for name, value in response["headers"]:
+			headers[name] = value
+		return response["status"], response["reason"], headers, base64.b64decode(response["body"])
+
+	return replay
+
+@contextmanager
+def _request_slot() -> Iterator[Callable[[], None]]:
+	"""
+	_request_slot waits for one of the current limit of request slots;
+	calling the yielded function halves the limit, otherwise it creeps
+	back up towards max_workers when the slot is released
+	"""
+	global _limit, _in_flight
+	throttled = False
+
+	def throttle():
+		nonlocal throttled
+		throttled = True
+
+	with _limit_changed:
+		if _limit == 0:
+			_limit = max_workers
+		while _in_flight >= int(_limit):
+			_limit_changed.wait()
+		_in_flight += 1
+	try:
+		yield throttle
+	finally:
+		with _limit_changed:
+			_in_flight -= 1
+			if throttled:
+				_limit = max(1.0, _limit / 2)
+			else:
+				_limit = min(float(max_workers), _limit + 1 / _limit)
+			_limit_changed.notify_all()
+
+def _get_executor() -> ThreadPoolExecutor:
+	global _executor
+	with _lock:
+		if _executor is None:
+			_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="wiki-api")
+		return _executor
+
+def normalize_title(title: str) -> str:
+	"""
+	normalize_title spells a title the way the wiki does without asking
+	it: underscores as spaces, single spaces, and a capital first letter.
+	A #section fragment keeps its case
+	"""
+	fragment = None
+	if "#" in title:
+		title, fragment = title.split("#", 1)
+	title = " ".join(title.replace("_", " ").split())
+	title = title[:1].upper() + title[1:]
+	if fragment is not None:
+		return title + "#" + " ".join(fragment.replace("_", " ").split())
+	return title
+
+def _resolve(name: str) -> str:
+	"""_resolve returns the title of the page a normalized title leads to, when known"""
+	return _aliases.get(name) or _stored_aliases.get(name, name)
+
+def get_pages(titles: Iterable[str]) -> Dict[str, str]:
+	"""
+	get_pages returns the wikitext of many pages at once, keyed by the
+	titles as requested; missing pages are left out. Titles are
+	normalized first, so different spellings and redirects to one page
+	share it. Pages come from the page store when their revision is still
+	current, everything else is fetched 50 titles per request, following
+	redirects once
+	"""
+	titles = list(dict.fromkeys(titles))
+	names = {title: normalize_title(title) for title in titles}
+	unique = list(dict.fromkeys(names.values()))
+	store = _get_page_store(unique)
+	add_dependencies(unique)
+	if revalidate:
+		stored = [name for name in unique if _resolve(name) in store and name not in _fresh]
+		if stored:
+			get_revisions(stored)
+			# a redirect may lead somewhere else now
+			store = _get_page_store(unique)
+	else:
+		_fresh.update(name for name in unique if _resolve(name) in store)
+		if use_cache:
+			_missing.update(cachedb.get_negatives("page", [name for name in unique if _resolve(name) not in store]))
+
+	stale = [name for name in unique if name not in _fresh and name not in _missing]
+	metrics.count("cache.pages.hit", len(unique) - len(stale))
+	metrics.count("cache.pages.miss", len(stale))
+	if stale:
+		pages = _query_revisions(stale, "ids|timestamp|content")
+		with _lock:
+			for page in pages.values():
+				store[page["title"]] = page
+		_dirty.update(page["title"] for page in pages.values())
+		_fresh.update(pages)
+		_missing.update(name for name in stale if name not in pages)
+	return {title: store[_resolve(names[title])]["content"] for title in titles if names[title] in _fresh}
+
+def get_revisions(titles: Iterable[str]) -> Dict[str, int]:
+	"""
+	get_revisions returns the current revision ID of each title that
+	exists, following redirects once, without downloading any content.
+	Stored pages found to be current need no revalidation afterwards
+	"""
+	pages = _query_revisions(titles, "ids")
+	store = _get_page_store()
+	# only the revision IDs of pages not read yet, their content is read when asked for
+	unread = [page["title"] for page in pages.values() if page["title"] not in store]
+	stored = cachedb.get_revisions(unread) if use_cache and unread else {}
+	for title, page in pages.items():
+		resolved = page["title"]
+		if (store[resolved]["revid"] if resolved in store else stored.get(resolved)) == page["revid"]:
+			_fresh.add(normalize_title(title))
+	return {title: page["revid"] for title, page in pages.items()}
+
+def get_versions(titles: Iterable[str]) -> Dict[str, Any]:
+	"""
+	get_versions asks the wiki for the current version of each
+	dependency: the revision ID of a page, or a hash of the member list
+	for a "Category:" entry. Missing pages map to None
 	"""
-	cache_file_name = category_name + ".cache.json"
-	if use_cache and os.path.isfile(cache_file_name):
-		with open(cache_file_name, "r") as fi:
-			return json.load(fi)
+	titles = list(dict.fromkeys(titles))
+	revisions = get_revisions(title for title in titles if not title.startswith(CATEGORY_PREFIX))
+	versions: Dict[str, Any] = {}
+	for title in titles:
+		if title.startswith(CATEGORY_PREFIX):
+			versions[title] = _member_hash(get_category_members(title[len(CATEGORY_PREFIX):]))
+		else:
+			versions[title] = revisions.get(title)
+	return versions
+
+def current_versions(titles: Iterable[str]) -> Dict[str, Any]:
+	"""
+	current_versions is get_versions for dependencies already read during
+	this run, answered from memory without making any requests
+	"""
+	titles = list(titles)
+	revisions = get_current_revisions(title for title in titles if not title.startswith(CATEGORY_PREFIX))
+	versions: Dict[str, Any] = {}
+	for title in titles:
+		if title.startswith(CATEGORY_PREFIX):
+			members = _categories.get(title[len(CATEGORY_PREFIX):])
+			versions[title] = _member_hash(members) if members is not None else None
+		else:
+			versions[title] = revisions[title][1] if title in revisions else None
+	return versions
 
-	pageids = []
-	for res in get_wiki_api(
-		{
+def get_current_revisions(titles: Iterable[str]) -> Dict[str, Tuple[str, int]]:
+	"""
+	get_current_revisions returns the title and revision ID of the page
+	each title leads to, for the titles this run already confirmed are
+	current, without reading any content or making any requests
+	"""
+	store = _get_page_store()
+	current = {title: _resolve(normalize_title(title)) for title in titles if normalize_title(title) in _fresh}
+	unread = [resolved for resolved in current.values() if resolved not in store]
+	stored = cachedb.get_revisions(unread) if unread else {}
+	revisions: Dict[str, Tuple[str, int]] = {}
+	for title, resolved in current.items():
+		revid = store[resolved]["revid"] if resolved in store else stored.get(resolved)
+		if revid is not None:
+			revisions[title] = (resolved, revid)
+	return revisions
+
+def _member_hash(members: List[str]) -> str:
+	return hashlib.sha1("\n".join(members).encode("utf-8")).hexdigest()
+
+@contextmanager
+def record_dependencies() -> Iterator[Set[str]]:
+	"""
+	record_dependencies collects the title of every page, and a
+	"Category:" entry for every category listing, read on this thread
+	while the block runs. Blocks can be nested
+	"""
+	pages: Set[str] = set()
+	_recorders().append(pages)
+	try:
+		yield pages
+	finally:
+		_recorders().pop()
+
+def add_dependencies(titles: Iterable[str]):
+	"""
+	add_dependencies marks titles as read for every active
+	record_dependencies block, e.g. when a result is reused from a cache
+	"""
+	recorders = _recorders()
+	if recorders:
+		titles = list(titles)
+		for pages in recorders:
+			pages.update(titles)
+
+def _recorders() -> List[Set[str]]:
+	if not hasattr(_local, "recorders"):
+		_local.recorders = []
+	return _local.recorders
+
+def _query_revisions(titles: Iterable[str], rvprop: str) -> Dict[str, Dict[str, Any]]:
+	titles = list(dict.fromkeys(titles))
+	if not titles:
+		return {}
+	aliases: Dict[str, str] = {}
+	revisions: Dict[str, Dict[str, Any]] = {}
+	args = {
 		"action": "query",
-		"list": "categorymembers",
-		"cmlimit": "500",
-		"cmtitle": "Category:" + category_name,
-		}, "cmcontinue"):
+		"prop": "revisions",
+		"rvprop": rvprop,
+		"titles": "|".join(titles),
+		"redirects": "1",
+	}
+	if "content" in rvprop:
+		args["rvslots"] = "main"
+	for res in get_wiki_api(args, "rvcontinue"):
+		query = res["query"]
+		for alias in query.get("normalized", []) + query.get("redirects", []):
+			aliases[alias["from"]] = alias["to"]
+		for page in query["pages"].values():
+			if "revisions" in page:
+				revision = page["revisions"][0]
+				revisions[page["title"]] = {
+					"title": page["title"],
+					"revid": revision["revid"],
+					"timestamp": revision.get("timestamp"),
+					"content": revision["slots"]["main"]["*"] if "slots" in revision else None,
+				}
+
+	pages: Dict[str, Dict[str, Any]] = {}
+	for title in titles:
+		resolved = title
+		# normalization first, then a single redirect hop
+		for _ in range(2):
+			resolved = aliases.get(resolved, resolved)
+		if resolved in revisions:
+			pages[title] = revisions[resolved]
+	with _lock:
+		_aliases.update((normalize_title(title), page["title"]) for title, page in pages.items())
+	return pages
+
+def _get_page_store(names: Iterable[str] = ()) -> Dict[str, Dict[str, Any]]:
+	"""
+	_get_page_store returns the pages read this run, after reading the
+	pages that the normalized titles in names lead to from cachedb, when
+	earlier runs stored them
+	"""
+	global _page_store
+	with _lock:
+		if _page_store is None:
+			_page_store = {}
+		store = _page_store
+		unread = [name for name in names if _resolve(name) not in store] if use_cache else []
+	if not unread:
+		return store
+	unknown = [name for name in unread if name not in _aliases and name not in _stored_aliases]
+	if unknown:
+		redirects = cachedb.get_redirects(unknown)
+		with _lock:
+			_stored_aliases.update(redirects)
+	stored = cachedb.get_pages(list(dict.fromkeys(_resolve(name) for name in unread)))
+	with _lock:
+		for title, page in stored.items():
+			store.setdefault(title, page)
+	return store
 
-		for page in res["query"]["categorymembers"]:
-			pageids.append(str(page["pageid"]))
+def save_page_store():
+	"""
+	save_page_store stores the pages fetched so far in cachedb, marks
+	the ones revalidated as current and records the missing pages, the
+	category listings and the redirects seen
+	"""
+	store = _get_page_store()
+	with _lock:
+		dirty = {title: store[title] for title in _dirty}
+		_dirty.clear()
+		aliases = dict(_aliases)
+		categories = dict(_categories)
+	cachedb.put_pages(dirty)
+	cachedb.touch("pages", {_resolve(name) for name in _fresh} - set(dirty))
+	cachedb.put_negatives("page", dict.fromkeys(_missing - _fresh))
+	cachedb.put_categories(categories)
+	cachedb.put_redirects(aliases)
+
+def get_run_state(titles: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+	"""
+	get_run_state returns the settings and everything read so far, so
+	another process can carry on where this one is; with titles, only
+	the stored pages those lead to are included
+	"""
+	store = _get_page_store()
+	if titles is not None:
+		resolved = (_resolve(normalize_title(title)) for title in titles)
+		store = {title: store[title] for title in resolved if title in store}
+	return {
+		"use_cache": use_cache,
+		"user_agent": user_agent,
+		"api_host": api_host,
+		"revalidate": revalidate,
+		"replay": _replay,
+		"db_file": cachedb.db_file,
+		"pages": store,
+		"dirty": _dirty & set(store),
+		"fresh": set(_fresh),
+		"missing": set(_missing),
+		"categories": dict(_categories),
+		"aliases": dict(_aliases),
+		"stored_aliases": dict(_stored_aliases),
+	}
+
+def set_run_state(state: Dict[str, Any]):
+	"""set_run_state loads the state from get_run_state into this process"""
+	global use_cache, user_agent, api_host, revalidate, _page_store, transport, _replay
+	use_cache, user_agent, api_host, revalidate = state["use_cache"], state["user_agent"], state["api_host"], state["revalidate"]
+	if state["replay"] != _replay:
+		_replay = state["replay"]
+		transport = _replayer(*_replay) if _replay else None
+	cachedb.db_file = state["db_file"]
+	with _lock:
+		_page_store = dict(state["pages"])
+	_dirty.clear()
+	_dirty.update(state["dirty"])
+	_fresh.clear()
+	_fresh.update(state["fresh"])
+	_missing.clear()
+	_missing.update(state["missing"])
+	_categories.clear()
+	_categories.update(state["categories"])
+	_aliases.clear()
+	_aliases.update(state["aliases"])
+	_stored_aliases.clear()
+	_stored_aliases.update(state["stored_aliases"])
 
-	pages = {}
-	for i in range(0, len(pageids), 50):
+def merge_run_state(state: Dict[str, Any]):
+	"""
+	merge_run_state adds the pages and category listings another process
+	read, from its get_run_state, to the ones read by this process
+	"""
+	store = _get_page_store()
+	for title, page in state["pages"].items():
+		store.setdefault(title, page)
+	_dirty.update(state["dirty"])
+	_fresh.update(state["fresh"])
+	_missing.update(state["missing"] - _fresh)
+	for category_name, members in state["categories"].items():
+		_categories.setdefault(category_name, members)
+	_aliases.update(state["aliases"])
+	for name, title in state["stored_aliases"].items():
+		_stored_aliases.setdefault(name, title)
+
+def get_category_members(category_name: str) -> List[str]:
+	"""
+	get_category_members lists the titles in a category, once per run.
+	Titles are in the order the page contents used to be fetched in:
+	batches of 50 in category order, each ordered by page ID
+	"""
+	if category_name not in _categories:
+		members = []
 		for res in get_wiki_api(
 			{
 			"action": "query",
-			"prop": "revisions",
-			"rvprop": "content",
-			"pageids": "|".join(pageids[i:i + 50]),
-			}, "rvcontinue"):
-			for id, page in res["query"]["pages"].items():
-				pages[page["title"]] = page["revisions"][0]["*"]
+			"list": "categorymembers",
+			"cmlimit": "500",
+			"cmtitle": CATEGORY_PREFIX + category_name,
+			}, "cmcontinue"):
+			members.extend(res["query"]["categorymembers"])
+		titles: List[str] = []
+		for i in range(0, len(members), 50):
+			titles.extend(page["title"] for page in sorted(members[i:i + 50], key=lambda page: page["pageid"]))
+		_categories[category_name] = titles
+	return _categories[category_name]
 
-	with open(cache_file_name, "w+") as fi:
-		json.dump(pages, fi)
+def list_category(category_name: str) -> List[str]:
+	"""
+	list_category returns the titles in a category like
+	get_category_members, from the cache database unless revalidating,
+	and records the category as a dependency
+	"""
+	if use_cache and not revalidate and category_name not in _categories:
+		stored = cachedb.get_category(category_name)
+		if stored is not None:
+			_categories[category_name] = stored
 
-	return pages
+	members = get_category_members(category_name)
+	add_dependencies([CATEGORY_PREFIX + category_name])
+	return members
+
+def query_category(category_name: str) -> Dict[str, str]:
+	"""
+	query_category returns a dict of page title to page wikitext
+	you can then use mwparserfromhell to parse the wikitext into
+	an ast
+	"""
+	return get_pages(list_category(category_name))
@@ -4,28 +4,55 @@ Usage:
     python apply_variants.py
 
 Reads:
-    variant_ids.json  -- manually-maintained base_id → extra_ids mapping
+    variant_ids.json  -- manually-maintained variant families and base_id → extra_ids edges
     recs/all.json     -- scraper output
 
 Writes:
     recs/all.json          -- updated (pretty-printed, 2-space indent)
     recs/all.min.json      -- updated (minified)
     recs/<Activity>.json   -- updated per-activity files
+    recs/all.min.json.gz, recs/all.compact.json, ...
+                           -- precompressed and compact exports, see export.py
+    recs/manifest.json     -- sha256 and size of every file in recs/
+
+Files are only rewritten when their content changes, atomically.
 
 The script is idempotent: running it twice will not double-add IDs.
 
+recequip.run applies the same expansion to its output before writing it, so
+this script is only needed after editing variant_ids.json by hand.
+
 Design notes:
+    - variant_ids.json holds "families", sets of IDs that are all variants of
+      each other, and "edges", one-way base_id → extra_ids mappings.  Families
+      sharing an ID are merged on load, and every member of a family expands
+      to all the other members followed by the extra_ids of its edge.  In the
+      older format, a plain list of base_id → extra_ids entries, only the first
+      entry of a base_id counted, so overlapping families did not join and an
+      edge on a family member was dropped.  That format is still accepted
+      (scripts/convert_variant_ids.py converts it).
     - Matching is done on base_id (integer), never on item name strings.
     - Directionality is implicit: only an entry whose base_id appears in an
       item's ID list triggers expansion.  If you do not want an upgraded item
       to expand backwards to its base, simply do not create an entry with the
       upgraded item's ID as base_id.
+    - Entries are indexed by base_id, so expansion costs one lookup per ID
+      rather than one pass over every entry per item.  When several entries
+      match an item they are all applied, in base_id order.  The pass over
+      every entry merged each match into the item's original list, so only
+      the last entry that added IDs was kept.  Both give the same output on
+      the current variant_ids.json (see tests/test_apply_variants.py), where
+      no item matches entries of two different families.
     - No external dependencies beyond the Python 3 standard library.
 """
 
 import json
 import os
 import sys
+from typing import NoReturn
+
+import output
+import export
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 VARIANT_IDS_PATH = os.path.join(SCRIPT_DIR, "variant_ids.json")
@@ -39,52 +66,67 @@ SLOT_KEYS = [
 ]
 
 
+def _fail(message: str) -> NoReturn:
+    print(f"ERROR: {message}", file=sys.stderr)
+    sys.exit(1)
+
+
+def _validate_id_list(value: object) -> bool:
+    return isinstance(value, list) and all(isinstance(x, int) for x in value)
+
+
 def load_variant_ids(path: str) -> dict[int, list[int]]:
     """Load and validate variant_ids.json.
 
-    Returns a dict mapping base_id -> list of extra_ids.
+    Returns a dict mapping base_id -> list of extra_ids, with families
+    expanded into one entry per member, ordered by base_id.
     Raises SystemExit on validation errors.
     """
     try:
         with open(path, encoding="utf-8") as f:
-            entries = json.load(f)
+            data = json.load(f)
     except FileNotFoundError:
-        print(f"ERROR: {path} not found.", file=sys.stderr)
-        sys.exit(1)
+        _fail(f"{path} not found.")
     except json.JSONDecodeError as exc:
-        print(f"ERROR: {path} is not valid JSON: {exc}", file=sys.stderr)
-        sys.exit(1)
+        _fail(f"{path} is not valid JSON: {exc}")
 
-    if not isinstance(entries, list):
-        print(f"ERROR: {path} must be a JSON array.", file=sys.stderr)
-        sys.exit(1)
+    if isinstance(data, list):
+        return load_edges(data, path)
+    if not isinstance(data, dict):
+        _fail(f"{path} must be a JSON object with 'families' and 'edges'.")
 
+    families = data.get("families", [])
+    edges = data.get("edges", [])
+    if not isinstance(families, list) or not isinstance(edges, list):
+        _fail(f"{path}: 'families' and 'edges' must be JSON arrays.")
+    for i, family in enumerate(families):
+        if not isinstance(family, dict):
+            _fail(f"Family {i} in {path} is not an object.")
+        if "ids" not in family:
+            _fail(f"Family {i} in {path} is missing required key 'ids'.")
+        if not _validate_id_list(family["ids"]):
+            _fail(f"Family {i} in {path}: 'ids' must be a list of integers.")
+
+    return expand_variant_families([family["ids"] for family in families], load_edges(edges, path))
+
+
+def load_edges(entries: list, path: str) -> dict[int, list[int]]:
+    """Validate base_id → extra_ids entries.
+
+    Returns a dict mapping base_id -> list of extra_ids, in file order.
+    Raises SystemExit on validation errors.
+    """
     lookup: dict[int, list[int]] = {}
     for i, entry in enumerate(entries):
         if not isinstance(entry, dict):
-            print(f"ERROR: Entry {i} in {path} is not an object.", file=sys.stderr)
-            sys.exit(1)
+            _fail(f"Entry {i} in {path} is not an object.")
         for required_key in ("base_id", "extra_ids"):
             if required_key not in entry:
-                print(
-                    f"ERROR: Entry {i} in {path} is missing required key '{required_key}'.",
-                    file=sys.stderr,
-                )
-                sys.exit(1)
+                _fail(f"Entry {i} in {path} is missing required key '{required_key}'.")
         if not isinstance(entry["base_id"], int):
-            print(
-                f"ERROR: Entry {i} in {path}: 'base_id' must be an integer.",
-                file=sys.stderr,
-            )
-            sys.exit(1)
-        if not isinstance(entry["extra_ids"], list) or not all(
-            isinstance(x, int) for x in entry["extra_ids"]
-        ):
-            print(
-                f"ERROR: Entry {i} in {path}: 'extra_ids' must be a list of integers.",
-                file=sys.stderr,
-            )
-            sys.exit(1)
+            _fail(f"Entry {i} in {path}: 'base_id' must be an integer.")
+        if not _validate_id_list(entry["extra_ids"]):
+            _fail(f"Entry {i} in {path}: 'extra_ids' must be a list of integers.")
         base_id: int = entry["base_id"]
         if base_id in lookup:
             print(
@@ -97,6 +139,37 @@ def load_variant_ids(path: str) -> dict[int, list[int]]:
     return lookup
 
 
+def expand_variant_families(families: list[list[int]], edges: dict[int, list[int]]) -> dict[int, list[int]]:
+    """Expand families and edges into a base_id → extra_ids lookup.
+
+    Families that share an ID are merged with a union-find, then every member
+    maps to the other members in ascending order, followed by the extra_ids
+    of its edge if it has one.  The lookup is ordered by base_id.
+    """
+    parent: dict[int, int] = {}
+
+    def find(x: int) -> int:
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for ids in families:
+        for x in ids:
+            parent[find(x)] = find(ids[0])
+
+    members: dict[int, list[int]] = {}
+    for x in sorted(parent):
+        members.setdefault(find(x), []).append(x)
+
+    lookup: dict[int, list[int]] = {}
+    for base_id in sorted(set(parent) | set(edges)):
+        peers = [x for x in members[find(base_id)] if x != base_id] if base_id in parent else []
+        lookup[base_id], _ = merge_ids(peers, edges.get(base_id, []))
+    return {base_id: extra_ids for base_id, extra_ids in lookup.items() if extra_ids}
+
+
 def merge_ids(existing_ids: list[int], extra_ids: list[int]) -> tuple[list[int], list[int]]:
     """Append extra_ids to existing_ids, deduplicating, preserving order.
 
@@ -113,15 +186,49 @@ def merge_ids(existing_ids: list[int], extra_ids: list[int]) -> tuple[list[int],
     return merged, added
 
 
+def build_variant_index(lookup: dict[int, list[int]]) -> dict[int, tuple[int, list[int]]]:
+    """Index variant entries by base_id for direct lookup.
+
+    Returns a dict mapping base_id -> (position in the lookup, extra_ids),
+    so an item's matching entries can be found from its own IDs and still be
+    applied in lookup order.
+    """
+    return {base_id: (position, extra_ids) for position, (base_id, extra_ids) in enumerate(lookup.items())}
+
+
+def expand_ids(
+    item_ids: list[int],
+    index: dict[int, tuple[int, list[int]]],
+) -> tuple[list[int], list[list[int]]]:
+    """Expand one item's ID list with the extras of every entry whose base_id it contains.
+
+    Matching is done against the item's original IDs only; entries are applied
+    in lookup order. Returns (merged_list, newly_added_ids per applied entry).
+    """
+    matches = sorted(index[item_id] for item_id in set(item_ids) if item_id in index)
+    merged = item_ids
+    added_per_entry: list[list[int]] = []
+    for _, extra_ids in matches:
+        merged, added = merge_ids(merged, extra_ids)
+        if added:
+            added_per_entry.append(added)
+    return merged, added_per_entry
+
+
 def apply_variants_to_styles(
     styles: list,
     lookup: dict[int, list[int]],
     activity_name: str,
+    index: dict[int, tuple[int, list[int]]] | None = None,
 ) -> list[tuple[str, str, list[int]]]:
     """Walk style objects and apply variant ID expansions in place.
 
-    Returns a list of (item_name, slot_key, added_ids) tuples for reporting.
+    Pass a prebuilt build_variant_index(lookup) as index when calling this for
+    many activities. Returns a list of (item_name, slot_key, added_ids) tuples
+    for reporting.
     """
+    if index is None:
+        index = build_variant_index(lookup)
     patches: list[tuple[str, str, list[int]]] = []
 
     for style in styles:
@@ -135,12 +242,10 @@ def apply_variants_to_styles(
                 for item_name, item_ids in tier_dict.items():
                     if not isinstance(item_ids, list):
                         continue
-                    for base_id, extra_ids in lookup.items():
-                        if base_id in item_ids:
-                            merged, added = merge_ids(item_ids, extra_ids)
-                            if added:
-                                tier_dict[item_name] = merged
-                                patches.append((item_name, slot_key, added))
+                    merged, added_per_entry = expand_ids(item_ids, index)
+                    if added_per_entry:
+                        tier_dict[item_name] = merged
+                        patches.extend((item_name, slot_key, added) for added in added_per_entry)
 
     return patches
 
@@ -167,20 +272,19 @@ def main() -> None:
     # Apply variants and collect patch report
     total_patches: list[tuple[str, str, str, list[int]]] = []
 
+    index = build_variant_index(lookup)
     for activity in all_data:
         activity_name = activity.get("name", "<unknown>")
         styles = activity.get("styles", [])
-        patches = apply_variants_to_styles(styles, lookup, activity_name)
+        patches = apply_variants_to_styles(styles, lookup, activity_name, index)
         for item_name, slot_key, added_ids in patches:
             total_patches.append((activity_name, item_name, slot_key, added_ids))
 
     # Write updated all.json (no trailing newline — matches util.write_json)
-    with open(ALL_JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(all_data, f, indent=2, ensure_ascii=False)
+    output.write_text(ALL_JSON_PATH, json.dumps(all_data, indent=2, ensure_ascii=False))
 
     # Write updated all.min.json
-    with open(ALL_MIN_JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(all_data, f, separators=(",", ":"), ensure_ascii=False)
+    output.write_text(ALL_MIN_JSON_PATH, json.dumps(all_data, separators=(",", ":"), ensure_ascii=False))
 
     # Write updated per-activity files
     for activity in all_data:
@@ -190,8 +294,9 @@ def main() -> None:
         styles = activity.get("styles", [])
         activity_path = os.path.join(RECS_DIR, f"{activity_name}.json")
         if os.path.exists(activity_path):
-            with open(activity_path, "w", encoding="utf-8") as f:
-                json.dump(styles, f, indent=2, ensure_ascii=False)
+            output.write_text(activity_path, json.dumps(styles, indent=2, ensure_ascii=False))
+    export.write_exports(RECS_DIR, all_data)
+    output.write_manifest(RECS_DIR)
 
     # Print summary
     if total_patches:
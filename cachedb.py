@@ -0,0 +1,370 @@
+"""The cache kept between runs, in a single SQLite database in WAL mode, with a command line to inspect and invalidate it.
+
+  python cachedb.py stats
+  python cachedb.py list pages 'Dragon*'
+  python cachedb.py show items 'Dragon claws'
+  python cachedb.py invalidate items 'Dragon*' 'Barrows*'
+  python cachedb.py evict
+
+Every row has a checked_at time: when a page, redirect or item_index entry
+was last fetched or confirmed current, when an item was resolved, and when a
+category listing, activity or negative result was recorded. evict drops rows
+older than their table's ttl; recequip.run does so before reading anything.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import metrics
+
+db_file: str = "wiki.cache.db"
+# seconds a row is kept after checked_at, None to keep it until it is replaced
+ttl: Dict[str, Optional[float]] = {
+    "pages": 30 * 86400,
+    "categories": 30 * 86400,
+    "items": 30 * 86400,
+    "activities": 30 * 86400,
+    "redirects": 30 * 86400,
+    "negatives": 86400,
+    "item_index": 30 * 86400,
+}
+
+# the key column of each table, matched by list and invalidate
+TABLES: Dict[str, str] = {
+    "pages": "title",
+    "categories": "name",
+    "items": "name",
+    "activities": "title",
+    "redirects": "title",
+    "negatives": "key",
+    "item_index": "title",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS pages (
+    title TEXT PRIMARY KEY, revid INTEGER NOT NULL, timestamp TEXT, content TEXT, checked_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS categories (name TEXT PRIMARY KEY, members TEXT NOT NULL, checked_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS items (name TEXT PRIMARY KEY, ids TEXT NOT NULL, deps TEXT, checked_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS activities (
+    title TEXT PRIMARY KEY, deps TEXT NOT NULL, styles TEXT, checked_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS redirects (title TEXT PRIMARY KEY, target TEXT NOT NULL, checked_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS negatives (
+    kind TEXT NOT NULL, key TEXT NOT NULL, deps TEXT, checked_at REAL NOT NULL, PRIMARY KEY (kind, key));
+CREATE TABLE IF NOT EXISTS item_index (
+    title TEXT PRIMARY KEY, revid INTEGER NOT NULL, ids TEXT NOT NULL, checked_at REAL NOT NULL);
+"""
+# bumped when a table changes, listing the tables to drop and create again for that version in MIGRATIONS
+SCHEMA_VERSION = 1
+MIGRATIONS: Dict[int, List[str]] = {}
+
+# sqlite limits the number of parameters of a statement
+_BATCH = 500
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+
+
+def connect() -> sqlite3.Connection:
+    """connect opens db_file once per process, creating the tables"""
+    global _conn
+    with _lock:
+        if _conn is None:
+            conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for table in sorted({table for v, tables in MIGRATIONS.items() if v > version for table in tables}):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.executescript(SCHEMA)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            _conn = conn
+        return _conn
+
+
+def close():
+    """close folds the write-ahead log back into db_file and closes it"""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            _conn.close()
+            _conn = None
+
+
+class _transaction:
+    def __enter__(self) -> sqlite3.Connection:
+        conn = connect()
+        _lock.acquire()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def __exit__(self, kind, value, traceback):
+        try:
+            _conn.execute("COMMIT" if kind is None else "ROLLBACK")
+        finally:
+            _lock.release()
+
+
+def _select(sql: str, keys: List[str], *params: Any) -> List[Tuple[Any, ...]]:
+    """_select runs sql, which has an IN ({}) for the keys, in batches"""
+    conn = connect()
+    rows: List[Tuple[Any, ...]] = []
+    with _lock:
+        for i in range(0, len(keys), _BATCH):
+            batch = keys[i:i + _BATCH]
+            rows.extend(conn.execute(sql.format(",".join("?" * len(batch))), (*params, *batch)))
+    return rows
+
+
+def get_meta(key: str) -> Optional[str]:
+    """get_meta returns a value recorded next to the tables, like the scraper version"""
+    with _lock:
+        row = connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def get_pages(titles: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """get_pages returns the stored pages of titles, in the form api keeps them in"""
+    rows = _select("SELECT title, revid, timestamp, content FROM pages WHERE title IN ({})", list(titles))
+    return {
+        title: {"title": title, "revid": revid, "timestamp": timestamp, "content": content}
+        for title, revid, timestamp, content in rows
+    }
+
+
+def get_revisions(titles: Iterable[str]) -> Dict[str, int]:
+    """get_revisions returns the revision ID of the stored pages of titles, without their content"""
+    return dict(_select("SELECT title, revid FROM pages WHERE title IN ({})", list(titles)))
+
+
+def put_pages(pages: Dict[str, Dict[str, Any]]):
+    """put_pages stores pages by their title, clearing negative results for them"""
+    now = time.time()
+    with _transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+            [(title, page["revid"], page.get("timestamp"), page.get("content"), now) for title, page in pages.items()])
+        conn.executemany("DELETE FROM negatives WHERE kind = 'page' AND key = ?", [(title,) for title in pages])
+
+
+def touch(table: str, keys: Iterable[str]):
+    """touch sets checked_at of the rows of keys to now, e.g. for pages found to be current"""
+    now = time.time()
+    with _transaction() as conn:
+        conn.executemany(f"UPDATE {table} SET checked_at = ? WHERE {TABLES[table]} = ?", [(now, key) for key in keys])
+
+
+def get_category(name: str) -> Optional[List[str]]:
+    """get_category returns the stored member titles of a category"""
+    with _lock:
+        row = connect().execute("SELECT members FROM categories WHERE name = ?", (name,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def put_categories(categories: Dict[str, List[str]]):
+    """put_categories stores the member titles of each category"""
+    now = time.time()
+    with _transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO categories VALUES (?, ?, ?)",
+                         [(name, json.dumps(members), now) for name, members in categories.items()])
+
+
+def get_redirects(titles: Iterable[str]) -> Dict[str, str]:
+    """get_redirects returns the title of the page each of titles redirected to, for those that did"""
+    return dict(_select("SELECT title, target FROM redirects WHERE title IN ({})", list(titles)))
+
+
+def put_redirects(aliases: Dict[str, str]):
+    """
+    put_redirects stores the title of the page each title led to. Titles
+    that lead to themselves are not redirects (any more) and are removed
+    """
+    now = time.time()
+    with _transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO redirects VALUES (?, ?, ?)",
+                         [(title, target, now) for title, target in aliases.items() if title != target])
+        conn.executemany("DELETE FROM redirects WHERE title = ?",
+                         [(title,) for title, target in aliases.items() if title == target])
+
+
+def get_negatives(kind: str, keys: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """get_negatives returns the keys with a negative result of kind, with the page versions it came from if any"""
+    rows = _select("SELECT key, deps FROM negatives WHERE kind = ? AND key IN ({})", list(keys), kind)
+    return {key: json.loads(deps) if deps is not None else None for key, deps in rows}
+
+
+def put_negatives(kind: str, keys: Mapping[str, Optional[Dict[str, Any]]]):
+    """put_negatives records that keys had no result of kind, with the page versions it came from if any"""
+    now = time.time()
+    with _transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO negatives VALUES (?, ?, ?, ?)",
+                         [(kind, key, json.dumps(deps) if deps is not None else None, now) for key, deps in keys.items()])
+
+
+def save_negatives(kind: str, keys: Mapping[str, Optional[Dict[str, Any]]]):
+    """
+    save_negatives is put_negatives for results that are saved again on
+    every run; rows whose page versions are unchanged keep their
+    checked_at, so ttl counts from when the result was first seen
+    """
+    now = time.time()
+    with _transaction() as conn:
+        conn.executemany(
+            "INSERT INTO negatives VALUES (?, ?, ?, ?) ON CONFLICT (kind, key) DO UPDATE SET "
+            "checked_at = CASE WHEN deps IS excluded.deps THEN checked_at ELSE excluded.checked_at END, "
+            "deps = excluded.deps",
+            [(kind, key, json.dumps(deps) if deps is not None else None, now) for key, deps in keys.items()])
+
+
+def get_item_index(titles: Iterable[str]) -> Dict[str, Tuple[int, List[int]]]:
+    """get_item_index returns the revision ID each of titles was indexed at and the ids found in it"""
+    rows = _select("SELECT title, revid, ids FROM item_index WHERE title IN ({})", list(titles))
+    return {title: (revid, json.loads(ids)) for title, revid, ids in rows}
+
+
+def put_item_index(entries: Dict[str, Tuple[int, List[int]]]):
+    """put_item_index stores the ids found in each page at a revision"""
+    now = time.time()
+    with _transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO item_index VALUES (?, ?, ?, ?)",
+                         [(title, revid, json.dumps(ids), now) for title, (revid, ids) in entries.items()])
+
+
+def get_items(names: Iterable[str]) -> Dict[str, Tuple[List[int], Optional[Dict[str, Any]]]]:
+    """get_items returns the stored ids of the items in names, with the page versions they were resolved from if any"""
+    rows = _select("SELECT name, ids, deps FROM items WHERE name IN ({})", list(names))
+    return {name: (json.loads(ids), json.loads(deps) if deps is not None else None) for name, ids, deps in rows}
+
+
+def save_items(items: Mapping[str, List[int]], deps: Mapping[str, Dict[str, Any]]):
+    """
+    save_items stores the ids of items, clearing negative results for
+    them. Rows whose ids and dependencies are unchanged keep their checked_at
+    """
+    now = time.time()
+    with _transaction() as conn:
+        conn.executemany(
+            "INSERT INTO items VALUES (?, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET "
+            "checked_at = CASE WHEN ids = excluded.ids AND deps IS excluded.deps THEN checked_at ELSE excluded.checked_at END, "
+            "ids = excluded.ids, deps = excluded.deps",
+            [(name, json.dumps(ids), json.dumps(deps[name]) if name in deps else None, now) for name, ids in items.items()])
+        conn.executemany("DELETE FROM negatives WHERE kind = 'item' AND key = ?", [(name,) for name in items])
+
+
+def delete_items(names: Iterable[str]):
+    """delete_items removes the stored ids of names, e.g. once their pages no longer list any"""
+    with _transaction() as conn:
+        conn.executemany("DELETE FROM items WHERE name = ?", [(name,) for name in names])
+
+
+def drop_items():
+    """drop_items removes every stored item and negative item result, e.g. once the scraper that resolved them changed"""
+    with _transaction() as conn:
+        conn.execute("DELETE FROM items")
+        conn.execute("DELETE FROM negatives WHERE kind = 'item'")
+
+
+def get_activities(titles: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """get_activities returns the recorded dependencies of the strategy pages of titles that have stored styles"""
+    rows = _select("SELECT title, deps FROM activities WHERE styles IS NOT NULL AND title IN ({})", list(titles))
+    return {title: json.loads(deps) for title, deps in rows}
+
+
+def load_activity_styles(titles: List[str]) -> Dict[str, str]:
+    """load_activity_styles returns the stored styles JSON of the strategy pages, before variants are applied"""
+    rows = _select("SELECT title, styles FROM activities WHERE styles IS NOT NULL AND title IN ({})", list(titles))
+    return dict(rows)
+
+
+def save_activities(version: str, activities: Dict[str, Dict[str, Any]], styles: Dict[str, str]):
+    """
+    save_activities makes the activities table hold exactly activities, recorded by scraper version,
+    with the styles JSON of those in styles; the others keep the styles they were stored with
+    """
+    now = time.time()
+    with _transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+        stored = {title for title, in conn.execute("SELECT title FROM activities")}
+        conn.executemany("DELETE FROM activities WHERE title = ?", [(title,) for title in stored - set(activities)])
+        conn.executemany(
+            "INSERT INTO activities VALUES (?, ?, ?, ?) ON CONFLICT (title) DO UPDATE SET "
+            "checked_at = CASE WHEN deps = excluded.deps THEN checked_at ELSE excluded.checked_at END, "
+            "deps = excluded.deps, styles = COALESCE(excluded.styles, styles)",
+            [(title, json.dumps(deps), styles.get(title), now) for title, deps in activities.items()])
+
+
+def evict() -> Dict[str, int]:
+    """evict deletes the rows whose ttl has passed and returns how many per table"""
+    now = time.time()
+    evicted = {}
+    with _transaction() as conn:
+        for table, seconds in ttl.items():
+            if seconds is not None:
+                evicted[table] = conn.execute(f"DELETE FROM {table} WHERE checked_at < ?", (now - seconds,)).rowcount
+                metrics.count(f"cachedb.evicted.{table}", evicted[table])
+    return evicted
+
+
+def invalidate(table: str, patterns: List[str]) -> int:
+    """invalidate deletes the rows of table whose key matches one of the glob patterns and returns how many"""
+    with _transaction() as conn:
+        return sum(
+            conn.execute(f"DELETE FROM {table} WHERE {TABLES[table]} GLOB ?", (pattern,)).rowcount
+            for pattern in patterns)
+
+
+def main(argv: Optional[List[str]] = None):
+    global db_file
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=db_file, help="database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="rows and age of each table")
+    listing = commands.add_parser("list", help="keys of a table, optionally matching a glob pattern")
+    listing.add_argument("table", choices=sorted(TABLES))
+    listing.add_argument("pattern", nargs="?", default="*")
+    show = commands.add_parser("show", help="one row of a table")
+    show.add_argument("table", choices=sorted(TABLES))
+    show.add_argument("key")
+    drop = commands.add_parser("invalidate", help="delete the rows of a table matching glob patterns")
+    drop.add_argument("table", choices=sorted(TABLES))
+    drop.add_argument("patterns", nargs="+")
+    commands.add_parser("evict", help="delete the rows whose ttl has passed")
+    args = parser.parse_args(argv)
+
+    db_file = args.db
+    conn = connect()
+    if args.command == "stats":
+        now = time.time()
+        for table, key in TABLES.items():
+            count, oldest = conn.execute(f"SELECT COUNT(*), MIN(checked_at) FROM {table}").fetchone()
+            age = f", oldest checked {(now - oldest) / 86400:.1f} days ago" if oldest is not None else ""
+            print(f"{table}: {count} rows{age}")
+        print(f"scraper version: {get_meta('version')}")
+    elif args.command == "list":
+        key = TABLES[args.table]
+        for value, in conn.execute(f"SELECT {key} FROM {args.table} WHERE {key} GLOB ? ORDER BY {key}", (args.pattern,)):
+            print(value)
+    elif args.command == "show":
+        cursor = conn.execute(f"SELECT * FROM {args.table} WHERE {TABLES[args.table]} = ?", (args.key,))
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+        if not rows:
+            sys.exit(f"{args.key} is not in {args.table}")
+        for row in rows:
+            print(json.dumps(dict(zip(columns, row)), indent=2))
+    elif args.command == "invalidate":
+        print(f"deleted {invalidate(args.table, args.patterns)} rows from {args.table}")
+    elif args.command == "evict":
+        print(json.dumps(evict(), indent=2))
+    close()
+
+
+if __name__ == "__main__":
+    main()
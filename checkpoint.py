@@ -0,0 +1,85 @@
+"""Append-only journal of scrape progress, so a crashed run can resume between full cache writes."""
+
+import os
+import json
+import time
+from typing import Any, Dict, List, Optional, TextIO
+
+journal_file: str = "checkpoint.journal"
+# seconds between full cache writes; in between, progress is only appended to the journal
+compact_interval: float = 60.0
+
+_journal: Optional[TextIO] = None
+_last_compaction: float = 0.0
+
+
+def start(version: str) -> List[Dict[str, Any]]:
+    """
+    start opens the journal for appending and returns the entries a
+    previous run with the same version left in it, up to the first
+    incomplete line. A journal from another version is discarded
+    """
+    global _journal, _last_compaction
+    entries: List[Dict[str, Any]] = []
+    valid = 0
+    if os.path.isfile(journal_file):
+        with open(journal_file, "rb") as fi:
+            lines = fi.read().split(b"\n")
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            header = None
+        if len(lines) > 1 and isinstance(header, dict) and header.get("version") == version:
+            valid = len(lines[0]) + 1
+            # the last element is what follows the final newline, a partial write or empty
+            for line in lines[1:-1]:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+                valid += len(line) + 1
+        # drop anything after the last complete entry, or the whole journal of another version
+        os.truncate(journal_file, valid)
+
+    _journal = open(journal_file, "a", encoding="utf-8")
+    if not valid:
+        _write({"version": version})
+    _last_compaction = time.monotonic()
+    return entries
+
+
+def append(entry: Dict[str, Any]):
+    """append adds an entry to the journal and flushes it to disk"""
+    if _journal is not None:
+        _write(entry)
+
+
+def _write(entry: Dict[str, Any]):
+    assert _journal is not None
+    _journal.write(json.dumps(entry, separators=(",", ":")) + "\n")
+    _journal.flush()
+    os.fsync(_journal.fileno())
+
+
+def due() -> bool:
+    """due tells whether compact_interval has passed since the caches were last written in full"""
+    return time.monotonic() - _last_compaction >= compact_interval
+
+
+def compacted(version: str):
+    """compacted empties the journal once everything in it has been written to the caches"""
+    global _last_compaction
+    if _journal is not None:
+        _journal.truncate(0)
+        _write({"version": version})
+    _last_compaction = time.monotonic()
+
+
+def finish():
+    """finish closes and removes the journal after a run completed"""
+    global _journal
+    if _journal is not None:
+        _journal.close()
+        _journal = None
+    if os.path.isfile(journal_file):
+        os.remove(journal_file)
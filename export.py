@@ -0,0 +1,225 @@
+"""Precompressed and compact exports of recs/all.min.json for plugin consumers.
+
+  python export.py [DIRECTORY]    # recs by default
+
+Next to all.min.json this writes all.min.json.gz and all.min.json.br
+(brotli is in the Pipfile; the .br files are skipped without it).
+all.compact.json, with the same siblings, stores every distinct item,
+its name and ID list, once in an "items" table and each tier of a slot
+as a list of indexes into it:
+
+  {"format": "recequip-compact", "version": 1,
+   "activities": [{"name": ..., "styles": [{"name": "Melee", "head": [[0, 1], [2]], ...}, ...]}, ...],
+   "items": [["Slayer helmet (i)", [11865, 25177, 26674]], ...]}
+
+The items come last, so CompactWriter can stream the activities as they
+are scraped. expand_compact turns it back into the all.json shape. Standard library only
+apart from brotli, so apply_variants.py can use it standalone.
+"""
+
+import os
+import sys
+import gzip
+import json
+import importlib
+import contextlib
+from types import ModuleType
+from typing import Any, Callable, ContextManager, Dict, Iterable, List, Optional, Tuple
+
+import output
+import metrics
+
+# looked up by name, brotli is optional and ships no type hints
+brotli: Optional[ModuleType]
+try:
+    brotli = importlib.import_module("brotli")
+except ImportError:
+    brotli = None
+
+MIN_NAME = "all.min.json"
+COMPACT_NAME = "all.compact.json"
+COMPACT_FORMAT = "recequip-compact"
+COMPACT_VERSION = 1
+
+# also write all.compact.json
+compact: bool = True
+gzip_level: int = 9
+brotli_quality: int = 11
+
+
+class _ItemTable:
+    """_ItemTable interns the items of activities, keyed by name and ID list"""
+
+    def __init__(self):
+        self.items: List[List[Any]] = []
+        self._index: Dict[Tuple[str, Tuple[int, ...]], int] = {}
+
+    def pack(self, activity: Dict[str, Any]) -> Dict[str, Any]:
+        """pack returns activity with the tiers of each slot replaced by item indexes"""
+        styles: List[Dict[str, Any]] = []
+        for style in activity["styles"]:
+            slots: Dict[str, Any] = {}
+            for key, value in style.items():
+                if not isinstance(value, list):
+                    slots[key] = value
+                    continue
+                tiers: List[List[int]] = []
+                for tier in value:
+                    refs: List[int] = []
+                    for name, ids in tier.items():
+                        item = (name, tuple(ids))
+                        if item not in self._index:
+                            self._index[item] = len(self.items)
+                            self.items.append([name, list(ids)])
+                        refs.append(self._index[item])
+                    tiers.append(refs)
+                slots[key] = tiers
+            styles.append(slots)
+        return {**activity, "styles": styles}
+
+
+def compact_activities(activities: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    compact_activities interns every item of the activities, keyed by name
+    and ID list, and replaces the tiers of each slot with item indexes
+    """
+    table = _ItemTable()
+    packed = [table.pack(activity) for activity in activities]
+    return {"format": COMPACT_FORMAT, "version": COMPACT_VERSION, "activities": packed, "items": table.items}
+
+
+class CompactWriter:
+    """
+    CompactWriter streams activities to a compact export one at a time,
+    byte for byte json.dumps(compact_activities(activities),
+    separators=(",", ":")), holding only the items table in memory. The
+    file is replaced when the writer is closed and only if its content
+    changed; leaving the block with an exception keeps the old file
+    """
+
+    def __init__(self, path: str):
+        self._file = output.StreamedFile(path)
+        self._table = _ItemTable()
+        self._count = 0
+        self._file.write('{"format":' + json.dumps(COMPACT_FORMAT) + ',"version":' + json.dumps(COMPACT_VERSION)
+            + ',"activities":[')
+
+    def __enter__(self) -> "CompactWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def append(self, activity: Dict[str, Any]):
+        """append writes activity as the next one of the export"""
+        packed = json.dumps(self._table.pack(activity), separators=(",", ":"))
+        self._file.write(("," if self._count else "") + packed)
+        self._count += 1
+
+    def close(self) -> bool:
+        """close writes the items table and commits the file. Returns whether it was written"""
+        self._file.write('],"items":' + json.dumps(self._table.items, separators=(",", ":")) + "}")
+        try:
+            return self._file.commit()
+        finally:
+            self.abort()
+
+    def abort(self):
+        """abort removes the temporary file and leaves the old one in place"""
+        self._file.abort()
+
+
+def open_compact(directory: str = "recs") -> ContextManager[Optional[CompactWriter]]:
+    """open_compact returns a CompactWriter for the compact export in directory, or None when compact is off"""
+    if not compact:
+        return contextlib.nullcontext()
+    return CompactWriter(os.path.join(directory, COMPACT_NAME))
+
+
+def expand_compact(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """expand_compact returns the activities of a compact export in the all.json shape"""
+    if data.get("format") != COMPACT_FORMAT or data.get("version") != COMPACT_VERSION:
+        raise ValueError(f"not a {COMPACT_FORMAT} version {COMPACT_VERSION} export")
+    items = data["items"]
+    return [
+        {**activity, "styles": [
+            {
+                key: [{items[i][0]: list(items[i][1]) for i in tier} for tier in value]
+                if isinstance(value, list) else value
+                for key, value in style.items()
+            }
+            for style in activity["styles"]
+        ]}
+        for activity in data["activities"]
+    ]
+
+
+def load_compact(path: str) -> List[Dict[str, Any]]:
+    """load_compact reads a compact export, optionally gzip or brotli compressed, in the all.json shape"""
+    with open(path, "rb") as fi:
+        data = fi.read()
+    if path.endswith(".gz"):
+        data = gzip.decompress(data)
+    elif path.endswith(".br"):
+        if brotli is None:
+            raise RuntimeError("reading .br files needs the brotli package")
+        data = brotli.decompress(data)
+    return expand_compact(json.loads(data))
+
+
+def write_exports(directory: str = "recs", activities: Optional[Iterable[Dict[str, Any]]] = None) -> None:
+    """
+    write_exports writes the compact export of activities, read from
+    all.min.json when not given, and the compressed siblings of
+    all.min.json and the compact export in directory, each only when its
+    content changed
+    """
+    with open_compact(directory) as writer:
+        if writer is not None:
+            if activities is None:
+                with open(os.path.join(directory, MIN_NAME), "rb") as fi:
+                    activities = json.load(fi)
+            for activity in activities:
+                writer.append(activity)
+    write_compressed_exports(directory)
+
+
+def write_compressed_exports(directory: str = "recs") -> None:
+    """write_compressed_exports writes the compressed siblings of all.min.json and, when compact is on, the compact export"""
+    for name in [MIN_NAME, COMPACT_NAME] if compact else [MIN_NAME]:
+        path = os.path.join(directory, name)
+        with open(path, "rb") as fi:
+            write_compressed(path, fi.read())
+
+
+def write_compressed(path: str, data: bytes) -> None:
+    """write_compressed writes the .gz and, with brotli installed, .br siblings of path holding data"""
+    _write_sibling(path + ".gz", data, gzip.decompress, lambda: gzip.compress(data, gzip_level, mtime=0))
+    if brotli is not None:
+        module = brotli
+        _write_sibling(path + ".br", data, module.decompress, lambda: module.compress(data, quality=brotli_quality))
+
+
+def _write_sibling(path: str, data: bytes, decompress: Callable[[bytes], bytes], compress: Callable[[], bytes]):
+    # decompressing is much cheaper than compressing again, brotli at quality 11 in particular
+    try:
+        with open(path, "rb") as fi:
+            if decompress(fi.read()) == data:
+                metrics.count("output.unchanged")
+                return
+    except Exception:  # pylint: disable=broad-except
+        # missing, or not a valid compressed file, so written again
+        pass
+    output.write_bytes(path, compress())
+
+
+def main(argv: Optional[List[str]] = None):
+    args = sys.argv[1:] if argv is None else argv
+    write_exports(args[0] if args else "recs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Index of the Infobox Item ids of every page in the item categories, kept in cachedb and refreshed by revision ID.
+
+  python itemindex.py [CATEGORY ...]    # the categories below by default
+
+recequip.get_ids_of_item takes the ids of a page from the index instead of
+parsing it, when the run has confirmed the page is still at the indexed
+revision. Set recequip.itemIndexCategories to refresh the index at the start
+of every run.
+"""
+
+import sys
+import json
+import argparse
+from typing import Dict, Iterable, List, Optional
+
+import api
+import util
+import metrics
+import cachedb
+
+categories: List[str] = ["Items"]
+# pages fetched and parsed per step while refreshing, each step is stored before the next
+batch_size: int = 500
+
+
+def refresh(category_names: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    """
+    refresh brings the index up to date with the pages of the categories:
+    the member lists and their revision IDs are read 500 and 50 titles per
+    request, then only the pages that are new or were edited since they
+    were indexed are fetched and parsed. Returns how many pages were
+    current and how many were indexed
+    """
+    titles = list(dict.fromkeys(
+        title for name in (categories if category_names is None else category_names)
+        for title in api.get_category_members(name)))
+    revisions = api.get_revisions(titles)
+    indexed = cachedb.get_item_index(revisions)
+    changed = [title for title, revid in revisions.items() if indexed.get(title, (None,))[0] != revid]
+    cachedb.touch("item_index", [title for title in revisions if title in indexed and title not in changed])
+    for i in range(0, len(changed), batch_size):
+        pages = api.get_pages(changed[i:i + batch_size])
+        # the revision of the content read, which may be newer than the one just checked
+        current = api.get_current_revisions(pages)
+        cachedb.put_item_index({
+            title: (current[title][1], util.get_infobox_item_ids(title, text))
+            for title, text in pages.items() if title in current
+        })
+        api.save_page_store()
+    metrics.count("item_index.current", len(revisions) - len(changed))
+    metrics.count("item_index.indexed", len(changed))
+    return {"current": len(revisions) - len(changed), "indexed": len(changed)}
+
+
+def get_current_ids(titles: Iterable[str]) -> Dict[str, List[int]]:
+    """
+    get_current_ids returns the indexed ids of each of titles whose page
+    this run confirmed is still at the indexed revision, without reading
+    the page. Other titles are left out and have to be read instead
+    """
+    revisions = api.get_current_revisions(titles)
+    indexed = cachedb.get_item_index({resolved for resolved, _ in revisions.values()})
+    ids: Dict[str, List[int]] = {}
+    for title, (resolved, revid) in revisions.items():
+        if resolved in indexed and indexed[resolved][0] == revid:
+            ids[title] = indexed[resolved][1]
+    metrics.count("cache.item_index.hit", len(ids))
+    return ids
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("categories", nargs="*", default=categories, help="categories to index")
+    args = parser.parse_args(argv)
+    counts = refresh(args.categories)
+    api.save_page_store()
+    cachedb.close()
+    json.dump(counts, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import os
+
 import api
 
 import recequip
@@ -5,4 +7,7 @@ import recequip
 api.use_cache = True
 
 recequip.useCache = True
-recequip.run()
+recequip.processes = os.cpu_count() or 1
+
+if __name__ == '__main__':
+    recequip.run()
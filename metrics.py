@@ -0,0 +1,135 @@
+"""Counters and timings collected while scraping, written out as a JSON run report."""
+
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# collect counters and timings; when False every call returns straight away
+enabled: bool = True
+# keep a progress line updated on stderr while activities are scraped
+progress: bool = False
+report_file: str = "run_report.json"
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_samples: Dict[str, List[float]] = {}
+# per label totals of a sample, e.g. the seconds spent on each activity
+_labels: Dict[str, Dict[str, float]] = {}
+
+
+def count(name: str, n: float = 1):
+    """count adds n to the counter name"""
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def observe(name: str, value: float, label: Optional[str] = None):
+    """observe records one sample of name, adding it to the total for label when given"""
+    if not enabled:
+        return
+    with _lock:
+        _samples.setdefault(name, []).append(value)
+        if label is not None:
+            labels = _labels.setdefault(name, {})
+            labels[label] = labels.get(label, 0) + value
+
+
+@contextmanager
+def timer(name: str, label: Optional[str] = None) -> Iterator[None]:
+    """timer observes the seconds the block takes as a sample of name"""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, label)
+
+
+def show_progress(done: int, total: int, label: str):
+    """show_progress rewrites the progress line on stderr, when progress is on"""
+    if not (enabled and progress):
+        return
+    requests = int(_counters.get("http.requests", 0))
+    sys.stderr.write(f"\r\033[K[{done}/{total}] {requests} requests, {label}")
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def snapshot() -> Dict[str, Any]:
+    """snapshot returns everything collected so far, for merge in another process"""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "samples": {name: list(values) for name, values in _samples.items()},
+            "labels": {name: dict(labels) for name, labels in _labels.items()},
+        }
+
+
+def merge(state: Dict[str, Any]):
+    """merge adds a snapshot taken in another process to what this process collected"""
+    if not enabled:
+        return
+    with _lock:
+        for name, n in state["counters"].items():
+            _counters[name] = _counters.get(name, 0) + n
+        for name, values in state["samples"].items():
+            _samples.setdefault(name, []).extend(values)
+        for name, labels in state["labels"].items():
+            totals = _labels.setdefault(name, {})
+            for label, value in labels.items():
+                totals[label] = totals.get(label, 0) + value
+
+
+def reset():
+    """reset forgets everything collected so far"""
+    with _lock:
+        _counters.clear()
+        _samples.clear()
+        _labels.clear()
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "total": sum(ordered),
+        "min": ordered[0],
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": ordered[-1],
+    }
+
+
+def report() -> Dict[str, Any]:
+    """report summarizes the counters and the distribution of each sample"""
+    with _lock:
+        return {
+            "counters": dict(sorted(_counters.items())),
+            "histograms": {name: _summary(values) for name, values in sorted(_samples.items()) if values},
+            "by_label": {
+                name: dict(sorted(labels.items(), key=lambda item: -item[1]))
+                for name, labels in sorted(_labels.items())
+            },
+        }
+
+
+def write_report(name: Optional[str] = None):
+    """write_report writes report() to report_file, unless collecting is off"""
+    if not enabled:
+        return
+    with open(name or report_file, "w+", encoding="utf-8") as fi:
+        json.dump(report(), fi, indent=2)
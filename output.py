@@ -0,0 +1,222 @@
+"""Write output files only when their content changes, atomically, and keep a manifest of them.
+
+JsonArrayWriter streams a JSON array to a pretty and a minified file at once,
+byte for byte what json.dumps(data, indent=2) and
+json.dumps(data, separators=(",", ":")) give for the whole array.
+
+Standard library only, so apply_variants.py can use it standalone.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import functools
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+
+MANIFEST_NAME = "manifest.json"
+# how many distinct lists of ints JsonArrayWriter keeps the encoding of
+INT_LIST_CACHE_SIZE = 4096
+
+
+def write_text(path: str, text: str) -> bool:
+    """
+    write_text writes text to path unless the file already holds exactly
+    that text, going through a temporary file and a rename so readers
+    never see a partial file. Returns whether the file was written
+    """
+    return write_bytes(path, text.encode("utf-8"))
+
+
+def write_bytes(path: str, data: bytes) -> bool:
+    """write_bytes is write_text for data that is already encoded"""
+    if _unchanged(path, data):
+        metrics.count("output.unchanged")
+        return False
+    directory = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fi:
+            fi.write(data)
+            fi.flush()
+            os.fsync(fi.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    metrics.count("output.written")
+    metrics.count("output.bytes", len(data))
+    return True
+
+
+def _unchanged(path: str, data: bytes) -> bool:
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, "rb") as fi:
+            return hashlib.sha256(fi.read()).digest() == hashlib.sha256(data).digest()
+    except FileNotFoundError:
+        return False
+
+
+def _file_digest(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as fi:
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: fi.read(1 << 20), b""):
+                digest.update(chunk)
+            return digest.digest()
+    except FileNotFoundError:
+        return None
+
+
+class StreamedFile:
+    """a temporary file next to path that replaces it on commit, unless path already holds the same bytes"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path) or "."
+        fd, self.tmp = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+        self.file = os.fdopen(fd, "wb")
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, text: str):
+        data = text.encode("utf-8")
+        self.file.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+
+    def commit(self) -> bool:
+        if os.path.isfile(self.path) and os.path.getsize(self.path) == self.size \
+                and _file_digest(self.path) == self.digest.digest():
+            self.abort()
+            metrics.count("output.unchanged")
+            return False
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tmp, self.path)
+        metrics.count("output.written")
+        metrics.count("output.bytes", self.size)
+        return True
+
+    def abort(self):
+        """abort closes and removes the temporary file, if it was not committed"""
+        self.file.close()
+        if os.path.exists(self.tmp):
+            os.unlink(self.tmp)
+
+
+class JsonArrayWriter:
+    """
+    JsonArrayWriter writes a JSON array to a pretty (indent=2) and a
+    minified file one element at a time, so the whole array never has to be
+    held in memory. Each element is encoded once for both files, and the
+    encoding of lists of ints, e.g. item ID lists repeated across
+    activities, is reused for the most recent INT_LIST_CACHE_SIZE of them. The files are replaced atomically when the
+    writer is closed and only if their content changed; leaving the block
+    with an exception keeps the old files
+    """
+
+    def __init__(self, path: str, min_path: str):
+        self._files = [StreamedFile(path)]
+        try:
+            self._files.append(StreamedFile(min_path))
+        except BaseException:
+            self.abort()
+            raise
+        self._count = 0
+
+    def __enter__(self) -> "JsonArrayWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def append(self, value: Any):
+        """append writes value as the next element of the array"""
+        pretty, minified = self._encode(value, 1)
+        self._files[0].write(("[\n  " if self._count == 0 else ",\n  ") + pretty)
+        self._files[1].write(("[" if self._count == 0 else ",") + minified)
+        self._count += 1
+
+    def close(self) -> Tuple[bool, bool]:
+        """close ends the array and commits both files. Returns whether each was written"""
+        self._files[0].write("\n]" if self._count else "[]")
+        self._files[1].write("]" if self._count else "[]")
+        try:
+            return self._files[0].commit(), self._files[1].commit()
+        finally:
+            self.abort()
+
+    def abort(self):
+        """abort removes the temporary files and leaves the old ones in place"""
+        for streamed in self._files:
+            streamed.abort()
+
+    def _encode(self, value: Any, depth: int) -> Tuple[str, str]:
+        """_encode returns the pretty encoding of value at depth levels of indentation, and its minified one"""
+        if value is None or isinstance(value, (str, bool, int, float)):
+            text = json.dumps(value)
+            return text, text
+        indent = "\n" + "  " * (depth + 1)
+        if isinstance(value, dict):
+            if not value:
+                return "{}", "{}"
+            pretty: List[str] = []
+            minified: List[str] = []
+            for key, item in value.items():
+                if not isinstance(key, str):
+                    raise TypeError(f"keys must be str, not {type(key).__name__}")
+                name = json.dumps(key)
+                item_pretty, item_minified = self._encode(item, depth + 1)
+                pretty.append(name + ": " + item_pretty)
+                minified.append(name + ":" + item_minified)
+            return "{" + indent + ("," + indent).join(pretty) + indent[:-2] + "}", "{" + ",".join(minified) + "}"
+        if isinstance(value, (list, tuple)):
+            if not value:
+                return "[]", "[]"
+            if all(type(item) is int for item in value):
+                return _encode_int_list(tuple(value), depth)
+            pretty, minified = [], []
+            for item in value:
+                item_pretty, item_minified = self._encode(item, depth + 1)
+                pretty.append(item_pretty)
+                minified.append(item_minified)
+            return "[" + indent + ("," + indent).join(pretty) + indent[:-2] + "]", "[" + ",".join(minified) + "]"
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+@functools.lru_cache(maxsize=INT_LIST_CACHE_SIZE)
+def _encode_int_list(values: Tuple[int, ...], depth: int) -> Tuple[str, str]:
+    """_encode_int_list is JsonArrayWriter._encode for a non-empty list of ints"""
+    indent = "\n" + "  " * (depth + 1)
+    numbers = [int.__repr__(item) for item in values]
+    return "[" + indent + ("," + indent).join(numbers) + indent[:-2] + "]", "[" + ",".join(numbers) + "]"
+
+
+def file_entry(path: str) -> Dict[str, Any]:
+    """file_entry returns the sha256 and size of a file, as listed in the manifest"""
+    with open(path, "rb") as fi:
+        data = fi.read()
+    return {"sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+
+
+def write_manifest(directory: str) -> bool:
+    """
+    write_manifest lists every .json file in directory with its sha256
+    and size in directory/manifest.json, so consumers can download only
+    the files that changed. Returns whether the manifest changed
+    """
+    files = {
+        name: file_entry(os.path.join(directory, name))
+        for name in sorted(os.listdir(directory))
+        if name.endswith(".json") and name != MANIFEST_NAME
+    }
+    return write_text(os.path.join(directory, MANIFEST_NAME), json.dumps({"files": files}, indent=2))
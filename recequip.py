@@ -1,20 +1,100 @@
 """Script to scrape recommended gear from the oldschool runescape wiki"""
 
 import os
+import re
 import sys
 import csv
 import json
+import time
+import hashlib
+import threading
+import multiprocessing
 from collections import defaultdict
-from itertools import chain
-from typing import Any
-import mwparserfromhell as mw
-from mwparserfromhell.nodes import Template, Tag, Text
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import chain, islice
+from typing import Any, Iterable, Iterator
+from mwparserfromhell.nodes import Template, Tag
 from mwparserfromhell.wikicode import Wikicode
 import api
 import util
+import metrics
+import apply_variants
+import output
+import export
+import checkpoint
+import cachedb
+import itemindex
 
 useCache: bool = True
+# skip activities whose pages have not changed since the last run
+incremental: bool = True
+# scrape changed strategy pages in this many worker processes, 1 scrapes them in this process
+processes: int = 1
+# merge the ids of item variants from this file into the output, see apply_variants.py; None to skip
+variantFile: str | None = 'variant_ids.json'
+# categories whose pages are kept in the item id index, refreshed at the start of every run, see itemindex.py; empty to read every item page
+itemIndexCategories: list[str] = []
 itemCache: dict[str, list[int]] = {}
+# the pages each cached item was resolved from, with their versions
+itemDeps: dict[str, dict[str, Any]] = {}
+# items whose pages list no ids, with the pages that said so; looked up again once one of those changes
+missingCache: dict[str, dict[str, Any]] = {}
+# read the items not in itemCache or missingCache from the cache database as they are needed, off once the scraper changed
+storedItems: bool = False
+# items already looked up in the cache database this run
+checkedItems: set[str] = set()
+# guards itemCache, itemDeps and missingCache, and the lookups still being resolved
+itemLock = threading.RLock()
+inflightItems: dict[str, Future[list[int]]] = {}
+# items without ids found this run, added to items_that_need_special_handling.txt by save_caches
+missingItems: set[str] = set()
+# pages a worker process was started with
+workerPages: set[str] = set()
+
+SLOTS = [
+    "head",
+    "neck",
+    "cape",
+    "body",
+    "legs",
+    "weapon",
+    "shield",
+    "ammo",
+    "hands",
+    "feet",
+    "ring",
+    "special",
+]
+# a slot tier parameter, e.g. head1
+SLOT_PARAM = re.compile(rf"({'|'.join(SLOTS)})([1-9]\d*)")
+
+DIARY_ITEMS = [
+    "Ardougne cloak",
+    "Desert amulet",
+    "Falador shield",
+    "Fremennik sea boots",
+    "Kandarin headgear",
+    "Karamja gloves",
+    "Rada's blessing",
+    "Explorer's ring",
+    "Morytania legs",
+    "Varrock armour",
+    "Western banner",
+    "Wilderness sword"
+]
+
+BARROWS_PIECES = {
+    'Barrows helm': ["Ahrim's hood", "Dharok's helm", "Guthan's helm", "Karil's coif", "Torag's helm", "Verac's helm"],
+    'Barrows body': ["Ahrim's robetop", "Dharok's platebody", "Guthan's platebody", "Karil's leathertop", "Torag's platebody", "Verac's brassard"],
+    'Barrows legs': ["Ahrim's robeskirt", "Dharok's platelegs", "Guthan's chainskirt", "Karil's leatherskirt", "Torag's platelegs", "Verac's plateskirt"],
+}
+
+LINK_PAGES = [
+    'Damaged book',
+    'Halo',
+]
+
+BLESSING_PAGES = ["God blessings", "Rada's blessing"]
 
 def get_item_page_code(itemName: str):
     """
@@ -26,43 +106,129 @@ def get_item_page_code(itemName: str):
     Returns:
         mwparserfromhell.wikicode.Wikicode: Parsed wiki page content
     """
-    itemPage = api.get_wiki_api({
-        'action': 'query',
-        'prop': 'revisions',
-        'rvprop': 'content',
-        'rvslots': 'main',
-        'titles': itemName,
-        'redirects': '1',
-    }, 'rvcontinue')
-    itemPage = list(itemPage)
-    itemPage = itemPage[0]['query']['pages']
-    pageID = list(itemPage.keys())[0]
-    itemPage = itemPage[pageID]["revisions"][0]['slots']['main']['*']
-    return mw.parse(itemPage, skip_style_tags=True)
-
-def get_ids_of_item(itemCode: Wikicode, itemName: str) -> list[int]:
-    """
-    Extract item IDs from a parsed wiki page containing item information.
+    itemPage = api.get_pages([itemName])[itemName]
+    return util.parse(itemPage)
+
+def get_cached_ids(itemName: str) -> list[int]:
+    """
+    Return the cached ids of an item and mark the pages they were resolved from as read.
+
+    Args:
+        itemName (str): Name of a cached item, in any spelling of its title
+
+    Returns:
+        list: List of item IDs cached for the item
+    """
+    itemName = api.normalize_title(itemName)
+    api.add_dependencies(itemDeps.get(itemName, {}))
+    return itemCache[itemName]
+
+def load_stored_items(names: Iterable[str]):
+    """
+    Read the items an earlier run stored in the cache database, keeping those whose pages are unchanged.
+
+    Items are read as they are needed instead of all at the start of a run,
+    and the pages the ones in names were resolved from are revalidated in one batch.
+    Items without ids are kept the same way in missingCache.
+
+    Args:
+        names (list): Normalized names of the items
+    """
+    with itemLock:
+        names = [name for name in dict.fromkeys(names)
+                 if name not in itemCache and name not in missingCache and name not in checkedItems]
+        checkedItems.update(names)
+    if not storedItems or not names:
+        return
+    stored = cachedb.get_items(names)
+    # without incremental, stored ids are reused without revalidating them and items without ids are looked up again
+    negatives = cachedb.get_negatives('item', [name for name in names if name not in stored]) if incremental else {}
+    recorded = {name: deps for name, (_, deps) in stored.items() if deps is not None}
+    recorded.update((name, deps) for name, deps in negatives.items() if deps is not None)
+    versions = api.get_versions(title for deps in recorded.values() for title in deps) if incremental else {}
+
+    def unchanged(name: str) -> bool:
+        if not incremental:
+            return True
+        return name in recorded and all(versions.get(title) == version for title, version in recorded[name].items())
+
+    with itemLock:
+        for name, (ids, deps) in stored.items():
+            if unchanged(name):
+                itemCache.setdefault(name, ids)
+                if deps is not None:
+                    itemDeps.setdefault(name, deps)
+        for name in negatives:
+            if unchanged(name):
+                missingCache.setdefault(name, recorded[name])
+    metrics.count("cache.items.stored", len(stored) + len(negatives))
+    metrics.count("cache.items.stale", sum(not unchanged(name) for name in chain(stored, negatives)))
+
+def is_cached_item(itemName: str) -> bool:
+    """
+    Check whether the ids of an item are cached, reading it from the cache database the first time.
+
+    Args:
+        itemName (str): Name of the item, in any spelling of its title
+
+    Returns:
+        bool: Whether get_cached_ids has the item
+    """
+    itemName = api.normalize_title(itemName)
+    load_stored_items([itemName])
+    return itemName in itemCache
+
+def get_page_section(itemName: str) -> tuple[str, str | None]:
+    """
+    Retrieve the wikitext of a wiki page and the section of it a name points at.
+
+    Args:
+        itemName (str): Name of the page (can include a section fragment)
+
+    Returns:
+        tuple: Raw wiki page content, and the section name or None for the whole page
+    """
+    sectionName = None
+    if '#' in itemName:
+        itemName, sectionName = itemName.split('#')
+        sectionName = sectionName.replace('_', ' ')
+    return api.get_pages([itemName])[itemName], sectionName
+
+def get_page_templates(itemName: str) -> list[util.ScannedTemplate]:
+    """
+    Retrieve the templates on a wiki page, or on one section of it.
+
+    Whole pages go through util.get_templates, which only does a full
+    mwparserfromhell parse when its scanner can't handle the page.
+
+    Args:
+        itemName (str): Name of the page (can include a section fragment)
+
+    Returns:
+        list: (name, params) of each template as returned by util.scan_templates
+    """
+    return util.get_templates(*get_page_section(itemName))
+
+def get_ids_of_item(pageName: str, itemName: str) -> list[int]:
+    """
+    Extract item IDs from a wiki page containing item information.
     
     Args:
-        itemCode (Wikicode): Parsed wiki page content
+        pageName (str): Name of the wiki page (can include a section fragment)
         itemName (str): Name of the item being processed
         
     Returns:
         list: List of item IDs found for the given item
     """
-    if itemName in itemCache:
-        return itemCache[itemName]
-    versions = util.each_version("Infobox Item", itemCode)
-    ids: list[int] = []
-    for (vid, version) in versions:
-        # if vid == -1:
-        #     continue
-        idsForVersion = util.get_ids_for_page(itemName + str(vid), version)
-        if idsForVersion is None:
-            continue
-        ids.extend(idsForVersion)
-    return ids
+    if is_cached_item(itemName):
+        return get_cached_ids(itemName)
+    if itemIndexCategories and '#' not in pageName:
+        indexed = itemindex.get_current_ids([pageName])
+        if pageName in indexed:
+            api.add_dependencies([api.normalize_title(pageName)])
+            return indexed[pageName]
+    itemPage, sectionName = get_page_section(pageName)
+    return util.get_infobox_item_ids(itemName, itemPage, sectionName)
 
 def handle_special_cases(itemName: str, template: Template) -> tuple[list[int] | None, str | None]:
     """
@@ -78,49 +244,21 @@ def handle_special_cases(itemName: str, template: Template) -> tuple[list[int] |
     Returns:
         tuple: (list of item IDs, item name) or (None, None) if no special case applies
     """
-    if itemName in itemCache:
-        return itemCache[itemName], itemName
+    if is_cached_item(itemName):
+        return get_cached_ids(itemName), itemName
     ids: list[int] = []
     if itemName.replace('_', ' ').startswith('Cape of Accomplishment'):
-        capePages = api.query_category('Capes of Accomplishment')
-        for capeName, capePage in capePages.items():
-            if capeName.endswith('cape'):
-                capeCode = mw.parse(capePage, skip_style_tags=True)
-                ids.extend(get_ids_of_item(capeCode, capeName))
+        for capeName in get_accomplishment_capes():
+            ids.extend(get_ids_of_item(capeName, capeName))
         return ids, itemName
-    elif itemName in [
-        "Ardougne cloak",
-        "Desert amulet",
-        "Falador shield",
-        "Fremennik sea boots",
-        "Kandarin headgear",
-        "Karamja gloves",
-        "Rada's blessing",
-        "Explorer's ring",
-        "Morytania legs",
-        "Varrock armour",
-        "Western banner",
-        "Wilderness sword"
-    ]:
+    elif itemName in DIARY_ITEMS:
         for i in range(1, 5):
             itemNameVersion = itemName + f" {i}"
-            itemCode = get_item_page_code(itemNameVersion)
-            ids.extend(get_ids_of_item(itemCode, itemNameVersion))
+            ids.extend(get_ids_of_item(itemNameVersion, itemNameVersion))
         return ids, itemName
-    elif itemName == 'Barrows helm':
-        for i in ["Ahrim's hood", "Dharok's helm", "Guthan's helm", "Karil's coif", "Torag's helm", "Verac's helm"]:
-            itemCode = get_item_page_code(i)
-            ids.extend(get_ids_of_item(itemCode, itemName))
-        return ids, itemName
-    elif itemName == 'Barrows body':
-        for i in ["Ahrim's robetop", "Dharok's platebody", "Guthan's platebody", "Karil's leathertop", "Torag's platebody", "Verac's brassard"]:
-            itemCode = get_item_page_code(i)
-            ids.extend(get_ids_of_item(itemCode, itemName))
-        return ids, itemName
-    elif itemName == 'Barrows legs':
-        for i in ["Ahrim's robeskirt", "Dharok's platelegs", "Guthan's chainskirt", "Karil's leatherskirt", "Torag's platelegs", "Verac's plateskirt"]:
-            itemCode = get_item_page_code(i)
-            ids.extend(get_ids_of_item(itemCode, itemName))
+    elif itemName in BARROWS_PIECES:
+        for i in BARROWS_PIECES[itemName]:
+            ids.extend(get_ids_of_item(i, itemName))
         return ids, itemName
     elif itemName == 'Barrows equipment':
         if template.has('txt'):
@@ -134,16 +272,13 @@ def handle_special_cases(itemName: str, template: Template) -> tuple[list[int] |
         return get_items_from_page('God spells'), itemName
 
     # Link pages
-    elif itemName in [
-        'Damaged book',
-        'Halo',
-    ]:
+    elif itemName in LINK_PAGES:
         itemCode = get_item_page_code(itemName)
         for link in itemCode.filter_wikilinks():
             ids.extend(get_items_from_page(link.title.strip()))
         return ids, itemName
     elif itemName == 'Blessing':
-        for i in ["God blessings", "Rada's blessing"]:
+        for i in BLESSING_PAGES:
             ids.extend(get_items_from_page(i))
         return ids, itemName
     return None, None
@@ -162,108 +297,326 @@ def get_alt_items(itemName: str) -> list[str]:
         return ["Skull sceptre", "Skull sceptre (i)"]
     return [itemName]
 
-def get_items_from_page(itemName: str):
+def get_listed_items(templates: list[util.ScannedTemplate]) -> tuple[list[str], bool]:
     """
-    Extract item IDs from a wiki page, handling various page structures and templates.
-    
+    Find the items a page lists, walking its templates the way get_items_from_page does.
+
     Args:
-        itemName (str): Name of the item or page to process (can include section fragments)
-        
+        templates (list): Templates of the wiki page, as returned by get_page_templates
+
     Returns:
-        list: List of unique item IDs found on the page
+        tuple: Names of the items listed on the page, and whether the page
+            itself is a real item page
     """
-    sectionName = None
-    if '#' in itemName:
-        itemName, sectionName = itemName.split('#')
-    itemCode = get_item_page_code(itemName)
-    if sectionName is not None:
-        itemCode = itemCode.get_sections(matches=sectionName.replace('_', ' '))[0]
-    ids: list[int] = []
-    for ft in itemCode.filter_templates():
+    names: list[str] = []
+    for name, params in templates:
         # Real item page, break out after getting ids
-        if ft.name.matches('Infobox Item'):
-            ids.extend(get_ids_of_item(itemCode, itemName))
-            break
+        if name == 'Infobox Item':
+            return names, True
 
         # If a page has a bonus table, use it to get ids
-        if ft.name.matches('Infotable Bonuses'):
-            positionalParams = [p.value.strip() for p in ft.params if not p.showkey]
+        if name == 'Infotable Bonuses':
+            positionalParams = [value.strip() for _, value, showkey in params if not showkey]
             for p in positionalParams:
-                for i in get_alt_items(p):
-                    itemCode = get_item_page_code(i)
-                    ids.extend(get_ids_of_item(itemCode, i))
+                names.extend(get_alt_items(p))
             break
 
-        if ft.name.matches('plink') or ft.name.matches('plinkp') or ft.name.matches('plinkt') or ft.name.matches('CostLine'):
-            subName = ft.params[0].value.strip()
-            for i in get_alt_items(subName):
-                itemCode = get_item_page_code(i)
-                ids.extend(get_ids_of_item(itemCode, i))
+        if name in ('Plink', 'Plinkp', 'Plinkt', 'CostLine'):
+            subName = params[0][1].strip()
+            names.extend(get_alt_items(subName))
             continue
+    return names, False
+
+def get_items_from_page(itemName: str):
+    """
+    Extract item IDs from a wiki page, handling various page structures and templates.
+    
+    Args:
+        itemName (str): Name of the item or page to process (can include section fragments)
+        
+    Returns:
+        list: List of unique item IDs found on the page
+    """
+    listedItems, isItemPage = get_listed_items(get_page_templates(itemName))
+    ids: list[int] = []
+    for i in listedItems:
+        ids.extend(get_ids_of_item(i, i))
+    if isItemPage:
+        ids.extend(get_ids_of_item(itemName, itemName.split('#')[0]))
 
     # remove duplicates from ids without changing order
     return list(dict.fromkeys(ids))
 
-def get_gear_from_slot(template: Template, slot: str) -> list[dict[str, list[int]]]:
+def get_slot_plinks(template: Template) -> dict[str, list[list[Template]]]:
+    """
+    Find the plink templates listed in each tier of every equipment slot.
+
+    The parameters of the template are bucketed by slot and tier in one pass.
+    As with Template.get, the last of repeated parameters wins, and tiers are
+    ordered by number with no upper limit.
+
+    Args:
+        template: Wiki template containing gear recommendations
+
+    Returns:
+        dict: Each slot in SLOTS to one list of plink templates per tier present in the template
+    """
+    tiers: dict[str, dict[int, Wikicode]] = {slot: {} for slot in SLOTS}
+    for param in template.params:
+        match = SLOT_PARAM.fullmatch(str(param.name).strip())
+        if match:
+            tiers[match[1]][int(match[2])] = param.value
+    return {slot: [get_plinks(slotTiers[tier]) for tier in sorted(slotTiers)] for slot, slotTiers in tiers.items()}
+
+def get_plinks(value: Wikicode) -> list[Template]:
+    """
+    Find the plink templates in the value of a slot tier.
+
+    Each top-level node is walked until a <ref> tag, so references are skipped.
+
+    Args:
+        value (Wikicode): Value of the slot tier parameter
+
+    Returns:
+        list: The plink templates in order
+    """
+    plinks: list[Template] = []
+    for node in value.nodes:
+        # Stolen and modified from Wikicode source
+        # pylint: disable=protected-access
+        for child in Wikicode._get_children(node): # type: ignore
+            if isinstance(child, Tag) and child.tag == 'ref':
+                break
+            if isinstance(child, Template):
+                # child.name.matches('plink'), without parsing 'plink' again for every template
+                name = child.name.strip_code().strip()
+                if (name[:1].upper() + name[1:]).replace('_', ' ') == 'Plink':
+                    plinks.append(child)
+    return plinks
+
+def get_gear_from_slot(tiers: list[list[Template]]) -> list[dict[str, list[int]]]:
     """
     Extract gear recommendations for a specific equipment slot from a template.
     
     Args:
-        template: Wiki template containing gear recommendations
-        slot (str): Equipment slot name (e.g., 'head', 'body', 'weapon')
+        tiers (list): The plink templates of each tier of the slot, as found by get_slot_plinks
         
     Returns:
         list: List of dictionaries containing gear items with their IDs for the slot
     """
     gear: list[dict[str, list[int]]] = []
-    for i in range(1, 6):
-        if template.has(f"{slot}{i}"):
-            # print(f"{slot}{i}")
-            item = template.get(f"{slot}{i}").value
-
-            # Stolen and modified from Wikicode source
-            def getter(i, node):
-                # pylint: disable=protected-access
-                for ch in Wikicode._get_children(node): # type: ignore
-                    if isinstance(ch, Tag) and ch.tag == 'ref':
-                        break
-                    if isinstance(ch, Text):
-                        continue
-                    yield (i, ch)
-            nodes = chain(*(getter(i, n) for i, n in enumerate(item.nodes)))
-            tmps = [node for i, node in nodes if isinstance(node, Template) and node.name.matches('plink')]
-
-            # No templates in slot
-            if len(tmps) == 0:
-                continue
-            itemsWithIDs: defaultdict[str, list[int]] = defaultdict(list)
-            for tmp in tmps:
-                name = tmp.params[0].value.strip()
+    for tmps in tiers:
+        # No templates in slot
+        if len(tmps) == 0:
+            continue
+        itemsWithIDs: defaultdict[str, list[int]] = defaultdict(list)
+        for tmp in tmps:
+            name = tmp.params[0].value.strip()
+            cached = is_cached_item(name)
+            with api.record_dependencies() as pages:
                 specialCase, specialCaseName = handle_special_cases(name, tmp)
-                if specialCase:
-                    specialCaseName = specialCaseName if specialCaseName else name
-                    itemCache[specialCaseName] = itemsWithIDs[specialCaseName] = specialCase
-                    continue
-
-                if name in itemCache:
-                    itemsWithIDs[name] = itemCache[name]
-                    continue
-
-                itemCache[name] = itemsWithIDs[name] = get_items_from_page(name)
-
-                # if no ids found, add it to a file to be manually checked later
-                if len(itemsWithIDs[name]) == 0:
-                    print(f'No ids found for {name}', file=sys.stderr)
-                    del itemCache[name]
-                    with open('items_that_need_special_handling.txt', 'r+', encoding='utf-8') as fi:
-                        if name in fi.read():
-                            continue
-                        fi.write(f'{name}\n')
-                    # raise Exception(f'No ids found for {name}')
-            gear.append(itemsWithIDs)
+            if specialCase:
+                specialCaseName = specialCaseName if specialCaseName else name
+                metrics.count("cache.items.hit" if cached else f"special_case.{specialCaseName}")
+                specialCaseDeps = api.current_versions(sorted(pages))
+                with itemLock:
+                    itemCache[api.normalize_title(specialCaseName)] = itemsWithIDs[specialCaseName] = specialCase
+                    itemDeps[api.normalize_title(specialCaseName)] = specialCaseDeps
+                continue
+
+            itemsWithIDs[name] = resolve_item(name)
+        gear.append(itemsWithIDs)
 
     return gear
 
+def resolve_item(name: str) -> list[int]:
+    """
+    Resolve the ids of an item page, sharing one lookup between threads asking for the same item.
+
+    The first caller resolves the page and fills itemCache, concurrent callers
+    wait for its result instead of fetching and parsing the page again. Names
+    are normalized first, so every spelling of a title shares one lookup.
+
+    Args:
+        name (str): Name of the item or page to process (can include section fragments)
+
+    Returns:
+        list: List of item IDs found for the item
+    """
+    name = api.normalize_title(name)
+    load_stored_items([name])
+    with itemLock:
+        if name in itemCache:
+            metrics.count("cache.items.hit")
+            return get_cached_ids(name)
+        if name in missingCache:
+            metrics.count("cache.missing.hit")
+            api.add_dependencies(missingCache[name])
+            return []
+        metrics.count("cache.items.miss")
+        future = inflightItems.get(name)
+        isOwner = future is None
+        if future is None:
+            future = inflightItems[name] = Future()
+    if not isOwner:
+        ids = future.result()
+        api.add_dependencies(itemDeps.get(name, {}))
+        return ids
+
+    try:
+        with api.record_dependencies() as pages:
+            ids = get_items_from_page(name)
+        deps = api.current_versions(sorted(pages))
+        with itemLock:
+            itemDeps[name] = deps
+            if len(ids) > 0:
+                itemCache[name] = ids
+            else:
+                missingCache[name] = deps
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with itemLock:
+            del inflightItems[name]
+    future.set_result(ids)
+
+    # if no ids found, add it to a file to be manually checked later
+    if len(ids) == 0:
+        print(f'No ids found for {name}', file=sys.stderr)
+        with itemLock:
+            missingItems.add(name)
+        # raise Exception(f'No ids found for {name}')
+    return ids
+
+def write_missing_items(fileName: str = 'items_that_need_special_handling.txt'):
+    """
+    Add the items found without ids this run to the file of items to be manually checked later.
+
+    Args:
+        fileName (str): Path of the file, one item name per line
+    """
+    listed: set[str] = set()
+    if os.path.isfile(fileName):
+        with open(fileName, 'r', encoding='utf-8') as fi:
+            listed = {line.rstrip('\n') for line in fi}
+    with itemLock:
+        newItems = sorted(missingItems - listed)
+    if newItems:
+        with open(fileName, 'a', encoding='utf-8') as fi:
+            fi.writelines(f'{name}\n' for name in newItems)
+
+def get_accomplishment_capes() -> list[str]:
+    """
+    List the capes in the Capes of Accomplishment category, which api.list_category lists once per run.
+
+    Returns:
+        list: Page titles of the capes, in category order
+    """
+    return [capeName for capeName in api.list_category('Capes of Accomplishment') if capeName.endswith('cape')]
+
+def plan_special_case(itemName: str, template: Template) -> list[tuple[str, str]] | None:
+    """
+    List the pages handle_special_cases will read for an item, without fetching them.
+
+    Category listings it reads are listed here already, so they reach the
+    worker processes with the page store.
+
+    Args:
+        itemName (str): Name of the item to process
+        template (Template): Wiki template containing item information
+
+    Returns:
+        list: (page name, kind) pairs as used by get_referenced_pages, or None if no special case applies
+    """
+    if itemName.replace('_', ' ').startswith('Cape of Accomplishment'):
+        return [(capeName, 'item') for capeName in get_accomplishment_capes()]
+    elif itemName in DIARY_ITEMS:
+        return [(itemName + f" {i}", 'item') for i in range(1, 5)]
+    elif itemName in BARROWS_PIECES:
+        return [(i, 'item') for i in BARROWS_PIECES[itemName]]
+    elif itemName == 'Barrows equipment':
+        if template.has('txt'):
+            return plan_special_case(template.get('txt').value.strip(), template)
+        return []
+    elif itemName == 'God staves':
+        return [('God spells', 'page')]
+    elif itemName in LINK_PAGES:
+        return [(itemName, 'links')]
+    elif itemName == 'Blessing':
+        return [(i, 'page') for i in BLESSING_PAGES]
+    return None
+
+def get_referenced_pages(pageName: str, kind: str) -> list[tuple[str, str]]:
+    """
+    List the pages that resolving a prefetched page will read next.
+
+    This mirrors the walk done by get_items_from_page and the link page
+    special case so the planner can fetch the next level in bulk.
+
+    Args:
+        pageName (str): Name of the page (can include a section fragment)
+        kind (str): 'item' for pages only read for their Infobox Item ids,
+            'page' for pages walked by get_items_from_page, 'links' for link pages
+
+    Returns:
+        list: (page name, kind) pairs for the pages read next
+    """
+    if kind == 'item':
+        return []
+    try:
+        if kind == 'links':
+            return [(link.title.strip(), 'page') for link in get_item_page_code(pageName).filter_wikilinks()]
+        listedItems, _ = get_listed_items(get_page_templates(pageName))
+    except (KeyError, IndexError):
+        # Missing pages and sections are left for the resolution pass to report
+        return []
+    return [(i, 'item') for i in listedItems]
+
+def prefetch_item_pages(strategyPages: list[str]):
+    """
+    Fetch every page the strategy pages will need before resolving any ids.
+
+    The plinks of every strategy page are collected first, then the pages they
+    reference are fetched level by level in 50 title batches into the page
+    store so the resolution pass does not have to make a request per item.
+
+    Args:
+        strategyPages (list): Raw wiki page content of each strategy page
+    """
+    plinks: list[tuple[str, Template]] = []
+    for page in strategyPages:
+        code = util.parse(page)
+        for template in util.filter_templates_by_name("Recommended equipment", code):
+            for tmps in chain.from_iterable(get_slot_plinks(template).values()):
+                plinks.extend((tmp.params[0].value.strip(), tmp) for tmp in tmps)
+    # the stored items are read and revalidated together, the ones still current need no pages
+    load_stored_items(api.normalize_title(name) for name, _ in plinks)
+    requests: list[tuple[str, str]] = []
+    for name, tmp in plinks:
+        if api.normalize_title(name) in itemCache or api.normalize_title(name) in missingCache:
+            continue
+        planned = plan_special_case(name, tmp)
+        requests.extend(planned if planned is not None else [(name, 'page')])
+
+    seen: set[tuple[str, str]] = set()
+    fetched: set[str] = set()
+    while requests:
+        requests = [r for r in dict.fromkeys(requests) if r not in seen]
+        seen.update(requests)
+        # items of a level are looked up in the cache database together rather than one by one while resolving
+        load_stored_items(api.normalize_title(title) for title, kind in requests if kind == 'item')
+        if itemIndexCategories:
+            # the ids of indexed items are taken from the index, their pages are not needed
+            indexed = itemindex.get_current_ids(title for title, kind in requests if kind == 'item' and '#' not in title)
+            requests = [(title, kind) for title, kind in requests if kind != 'item' or title not in indexed]
+        titles = [title.split('#')[0] for title, _ in requests]
+        titles = [title for title in dict.fromkeys(titles) if title not in fetched]
+        fetched.update(titles)
+        print(f'Prefetching {len(titles)} pages')
+        api.get_pages(titles)
+        requests = [ref for title, kind in requests for ref in get_referenced_pages(title, kind)]
+
 def get_page_tabs(page: str) -> list[dict[str, Any]]:
     """
     Extract all gear recommendation styles/tabs from a wiki page.
@@ -274,7 +627,7 @@ def get_page_tabs(page: str) -> list[dict[str, Any]]:
     Returns:
         list: List of dictionaries containing gear recommendations for each style/tab
     """
-    code = mw.parse(page, skip_style_tags=True)
+    code = util.parse(page)
     tabs: list[dict[str, Any]] = []
 
     # Will probably need to do better parsing to be able to utilize tab names. Not all tabs have the rec template.
@@ -292,42 +645,216 @@ def get_page_tabs(page: str) -> list[dict[str, Any]]:
         styleName: str = str(template.get("style").value.strip()) if template.has("style") else "Default"
         style: dict[str, Any] = { 'name': styleName }
         print('Getting recs for', styleName)
-        slots = [
-            "head",
-            "neck",
-            "cape",
-            "body",
-            "legs",
-            "weapon",
-            "shield",
-            "ammo",
-            "hands",
-            "feet",
-            "ring",
-            "special",
-        ]
-        for slot in slots:
-            style[slot] = get_gear_from_slot(template, slot)
+        slotPlinks = get_slot_plinks(template)
+        for slot in SLOTS:
+            with metrics.timer("slot.seconds", slot):
+                style[slot] = get_gear_from_slot(slotPlinks[slot])
         tabs.append(style)
     return tabs
 
+def get_scraper_version() -> str:
+    """
+    Hash the source that decides the scraped output, so a code change forces a full rebuild.
+
+    Returns:
+        str: Hex digest of recequip.py and util.py
+    """
+    digest = hashlib.sha1()
+    for module in (__file__, util.__file__):
+        with open(module, 'rb') as fi:
+            digest.update(fi.read())
+    return digest.hexdigest()
+
+def check_dependencies(dependencies: dict[str, Any]) -> set[str]:
+    """
+    Revalidate the pages recorded by earlier runs and drop journaled items that went stale.
+
+    Stored items are revalidated as they are read, by load_stored_items; once
+    the scraper changed they are deleted instead.
+
+    Args:
+        dependencies (dict): The scraper version stored by the last run, the recorded dependencies
+            of this run's activities and the items, item dependencies and missing items journaled
+
+    Returns:
+        set: Titles of the strategy pages whose recorded dependencies are all unchanged
+    """
+    if dependencies.get('version') != get_scraper_version():
+        global storedItems
+        print('Scraper changed since the last run, rebuilding everything')
+        itemCache.clear()
+        itemDeps.clear()
+        missingCache.clear()
+        storedItems = False
+        cachedb.drop_items()
+        return set()
+
+    itemDeps.update(dependencies.get('items', {}))
+    missingCache.update(dependencies.get('missing', {}))
+    activities: dict[str, dict[str, Any]] = dependencies.get('activities', {})
+    titles = [title for deps in chain(itemDeps.values(), missingCache.values(), activities.values()) for title in deps]
+    versions = api.get_versions(titles)
+
+    def unchanged(deps: dict[str, Any]) -> bool:
+        return all(versions.get(title) == version for title, version in deps.items())
+
+    for name in list(itemCache):
+        if name not in itemDeps or not unchanged(itemDeps[name]):
+            del itemCache[name]
+            itemDeps.pop(name, None)
+    for name in list(missingCache):
+        if not unchanged(missingCache[name]):
+            del missingCache[name]
+    return {title for title, deps in activities.items() if unchanged(deps)}
+
+def init_worker(state: dict[str, Any]):
+    """
+    Set up a worker process with the pages, item cache and settings of the main process.
+
+    Args:
+        state (dict): Main process state as built by scrape_strategies
+    """
+    global itemCache, itemDeps, missingCache, workerPages, itemIndexCategories, storedItems, incremental
+    api.set_run_state(state['api'])
+    itemIndexCategories = state['itemIndexCategories']
+    storedItems = state['storedItems']
+    incremental = state['incremental']
+    itemCache = state['itemCache']
+    itemDeps = state['itemDeps']
+    missingCache = state['missingCache']
+    workerPages = set(state['api']['pages'])
+
+def scrape_strategy(title: str, page: str) -> dict[str, Any]:
+    """
+    Scrape one strategy page in a worker process.
+
+    Args:
+        title (str): Title of the strategy page
+        page (str): Raw wiki page content
+
+    Returns:
+        dict: The gear recommendations and dependencies of the page, plus the
+            items, item dependencies, missing items and pages it added
+    """
+    knownItems = set(itemCache)
+    knownMissing = set(missingCache)
+    knownDeps = dict(itemDeps)
+    missingItems.clear()
+    metrics.reset()
+    with api.record_dependencies() as deps, metrics.timer("activity.seconds", title):
+        styles = get_page_tabs(page)
+    return {
+        'styles': styles,
+        'deps': api.current_versions(sorted(deps | {title})),
+        'items': {name: ids for name, ids in itemCache.items() if name not in knownItems},
+        'itemDeps': {name: d for name, d in itemDeps.items() if knownDeps.get(name) is not d},
+        'missingCache': {name: deps for name, deps in missingCache.items() if name not in knownMissing},
+        'missing': sorted(missingItems),
+        'api': api.get_run_state(title for title in deps if title not in workerPages),
+        'metrics': metrics.snapshot(),
+    }
+
+def scrape_strategies(titles: list[str], strategyPages: dict[str, str]) -> Iterator[tuple[list[dict[str, Any]], dict[str, Any]]]:
+    """
+    Scrape the strategy pages in order, spread over `processes` worker processes.
+
+    Worker results are merged back into the item cache in page order, so the
+    caches and outputs are the same as when scraping in this process.
+
+    Args:
+        titles (list): Titles of the strategy pages to scrape, in output order
+        strategyPages (dict): Raw wiki page content of each strategy page
+
+    Yields:
+        tuple: Gear recommendations of each page, and the versions of the pages it read
+    """
+    if processes <= 1 or len(titles) <= 1:
+        for title in titles:
+            with api.record_dependencies() as deps, metrics.timer("activity.seconds", title):
+                styles = get_page_tabs(strategyPages[title])
+            yield styles, api.current_versions(sorted(deps | {title}))
+        return
+
+    state = {
+        'api': api.get_run_state(),
+        'itemCache': itemCache,
+        'itemDeps': itemDeps,
+        'missingCache': missingCache,
+        'itemIndexCategories': itemIndexCategories,
+        'storedItems': storedItems,
+        'incremental': incremental,
+    }
+    # spawn rather than fork, the api module has threads and connections open
+    with ProcessPoolExecutor(min(processes, len(titles)), mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker, initargs=(state,)) as executor:
+        for result in executor.map(scrape_strategy, titles, [strategyPages[title] for title in titles]):
+            with itemLock:
+                for name, ids in result['items'].items():
+                    itemCache.setdefault(name, ids)
+                itemDeps.update(result['itemDeps'])
+                for name, missingDeps in result['missingCache'].items():
+                    missingCache.setdefault(name, missingDeps)
+                missingItems.update(result['missing'])
+            api.merge_run_state(result['api'])
+            metrics.merge(result['metrics'])
+            yield result['styles'], result['deps']
+
+def save_caches(activities: dict[str, dict[str, Any]], styles: dict[str, str]):
+    """
+    Store the pages, items and dependencies of the activities scraped so far in the cache database.
+
+    Args:
+        activities (dict): Recorded dependencies of each strategy page by title
+        styles (dict): Styles JSON, before variants are applied, of the strategy pages scraped since the last save
+    """
+    api.save_page_store()
+    cachedb.save_items(itemCache, itemDeps)
+    cachedb.save_negatives('item', missingCache)
+    # items whose pages no longer list any ids, the others keep what they were stored with
+    cachedb.delete_items(missingCache)
+    cachedb.save_activities(get_scraper_version(), activities, styles)
+    write_missing_items()
+
 def run():
     """
     Main function to scrape recommended gear from the Old School RuneScape wiki.
     
     This function:
-    1. Loads cached item IDs if available
+    1. Replays the journal of an interrupted run, if any
     2. Reads strategy data from CSV file
-    3. Fetches wiki pages for each strategy
-    4. Extracts gear recommendations from each page
-    5. Saves results to JSON files
-    6. Updates the item cache
-    """
-    itemCacheFile = 'item_ids.cache.json'
-    if useCache and os.path.isfile(itemCacheFile):
-        with open(itemCacheFile, 'r') as fi:
-            global itemCache
-            itemCache = json.load(fi)
+    3. Revalidates the pages the activities depended on last time
+    4. Fetches wiki pages for each changed strategy
+    5. Extracts gear recommendations from each changed page, reading cached item IDs as they are needed
+    6. Merges in item variant IDs from variant_ids.json
+    7. Saves results to JSON files, journaling progress so an interrupted run can resume
+    8. Updates the cache database
+    """
+    global storedItems
+    for table, evicted in cachedb.evict().items():
+        if evicted:
+            print(f'Evicted {evicted} {table} from {cachedb.db_file}')
+    dependencies: dict[str, Any] = {}
+    # styles of the activities scraped but not saved to the cache database yet, before variants are applied
+    activityStyles: dict[str, str] = {}
+    # the items stored by earlier runs are read as they are needed, see load_stored_items
+    storedItems = useCache
+    if useCache:
+        dependencies = {'version': cachedb.get_meta('version')}
+    version = get_scraper_version()
+    if useCache and incremental:
+        journal = checkpoint.start(version)
+        if journal:
+            print(f'Resuming after {len(journal)} activities from {checkpoint.journal_file}')
+            if dependencies.get('version') != version:
+                # the interrupted run already started over, the journal holds all it kept
+                dependencies = {'version': version}
+        for entry in journal:
+            itemCache.update(entry['items'])
+            dependencies.setdefault('items', {}).update(entry['itemDeps'])
+            dependencies.setdefault('missing', {}).update(entry['missing'])
+            missingItems.update(entry['missing'])
+            dependencies.setdefault('activities', {})[entry['activity']] = entry['deps']
+            activityStyles[entry['activity']] = entry['styles']
     os.makedirs('recs', exist_ok=True)
     with open('data_to_import.csv', 'r') as csvfile:
         data = csv.reader(csvfile)
@@ -357,33 +884,98 @@ def run():
         #     # 'The Hueycoatl/Strategies',
         #     'Doom_of_Mokhaiotl/Strategies'
         # ]
+        # Only revision ids here, the order of the results is the order of recs/all.json
         res = api.get_wiki_api({
             "action": "query",
             "prop": "revisions",
-            "rvprop": "content",
-            "rvslots": "main",
+            "rvprop": "ids",
             "titles": '|'.join(titles)
         }, "rvcontinue")
 
         urlMap = { row["title"].split('#')[0]: row for row in strategies }
 
-        allActivityGearRecs: list[dict[str, Any]] = []
-        for pageBatch in res:
-            for pageID, page in pageBatch['query']['pages'].items():
-                print(page['title'], pageID)
-                pageContent = page["revisions"][0]['slots']['main']["*"]
-                allGearRecs = get_page_tabs(pageContent)
+        pages = [(pageID, page) for pageBatch in res for pageID, page in pageBatch['query']['pages'].items()]
+        if useCache:
+            # the activities of this run's strategy pages, replaced by the ones journaled since they were stored
+            dependencies['activities'] = {
+                **cachedb.get_activities(page['title'] for _, page in pages), **dependencies.get('activities', {})}
+        with metrics.timer("stage.seconds", "revalidate"):
+            upToDate = check_dependencies(dependencies) if incremental else set()
+        if itemIndexCategories:
+            with metrics.timer("stage.seconds", "item index"):
+                itemindex.refresh(itemIndexCategories)
+        upToDate = {page['title'] for _, page in pages if page['title'] in upToDate}
+        activities: dict[str, dict[str, Any]] = {
+            title: deps for title, deps in dependencies.get('activities', {}).items() if title in upToDate
+        }
+        with metrics.timer("stage.seconds", "fetch strategies"):
+            strategyPages = api.get_pages(page['title'] for _, page in pages if page['title'] not in upToDate)
+        with metrics.timer("stage.seconds", "prefetch"):
+            prefetch_item_pages(list(strategyPages.values()))
+        scraped = scrape_strategies([page['title'] for _, page in pages if page['title'] not in upToDate], strategyPages)
+
+        variantLookup: dict[int, list[int]] = {}
+        if variantFile is not None and os.path.isfile(variantFile):
+            variantLookup = apply_variants.load_variant_ids(variantFile)
+        variantIndex = apply_variants.build_variant_index(variantLookup)
+
+        # activities are streamed to recs/all.json, recs/all.min.json and the compact export as they finish,
+        # which are replaced at the end
+        with output.JsonArrayWriter('recs/all.json', 'recs/all.min.json') as allActivityGearRecs, \
+                export.open_compact('recs') as compactGearRecs:
+            # itemCache and missingCache only grow from here on, so entries past these counts are not journaled yet
+            journaledItems, journaledMissing = len(itemCache), len(missingCache)
+            scrapeStart = time.perf_counter()
+            for i, (pageID, page) in enumerate(pages):
                 data = urlMap[page['title'].replace(' ', '_')]
                 name = data['name']
+                if page['title'] in upToDate:
+                    print(page['title'], pageID, 'unchanged')
+                    metrics.count("activities.unchanged")
+                    # recs/<name>.json has variants applied, so the styles from before are expanded again
+                    styles = activityStyles.get(page['title']) or cachedb.load_activity_styles([page['title']])[page['title']]
+                    allGearRecs = json.loads(styles)
+                else:
+                    print(page['title'], pageID)
+                    metrics.count("activities.scraped")
+                    allGearRecs, activities[page['title']] = next(scraped)
+                    activityStyles[page['title']] = json.dumps(allGearRecs)
+                metrics.show_progress(i + 1, len(pages), page['title'])
+                # expansions replace the id lists, so the lists shared with itemCache are left alone
+                variantPatches = apply_variants.apply_variants_to_styles(allGearRecs, variantLookup, name, variantIndex)
+                metrics.count("variants.applied", len(variantPatches))
                 newData = {
                     **data,
                     'styles': allGearRecs
                 }
                 del newData['title']
                 allActivityGearRecs.append(newData)
-
+                if compactGearRecs is not None:
+                    compactGearRecs.append(newData)
+                # rewritten only when it changed, e.g. when variant_ids.json was edited
                 util.write_json(f'recs/{name}.json', None, allGearRecs)
-                util.write_json(None, itemCacheFile, itemCache)
-        util.write_json(f'recs/all.json', f'recs/all.min.json', allActivityGearRecs)
-    util.write_json(None, itemCacheFile, itemCache)
 
+                if page['title'] not in upToDate:
+                    newItems = dict(islice(itemCache.items(), journaledItems, None))
+                    newMissing = dict(islice(missingCache.items(), journaledMissing, None))
+                    journaledItems, journaledMissing = len(itemCache), len(missingCache)
+                    checkpoint.append({
+                        'items': newItems,
+                        'itemDeps': { item: itemDeps[item] for item in newItems if item in itemDeps },
+                        'missing': newMissing,
+                        'activity': page['title'],
+                        'deps': activities[page['title']],
+                        'styles': activityStyles[page['title']],
+                    })
+                    if checkpoint.due():
+                        save_caches(activities, activityStyles)
+                        checkpoint.compacted(version)
+                        activityStyles.clear()
+        metrics.observe("stage.seconds", time.perf_counter() - scrapeStart, "scrape")
+        with metrics.timer("stage.seconds", "export"):
+            export.write_compressed_exports('recs')
+        output.write_manifest('recs')
+    save_caches(activities, activityStyles)
+    checkpoint.finish()
+    cachedb.close()
+    metrics.write_report()
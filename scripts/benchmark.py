@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Benchmark a full recequip.run against a recorded cassette of wiki responses, without network access.
+
+  python scripts/benchmark.py record bench.cassette.json.gz   # scrape the live wiki once, recording it
+  python scripts/benchmark.py run bench.cassette.json.gz [--latency 0.05] [--warm] [--processes N]
+
+Each run happens in a fresh temporary directory with only data_to_import.csv, so the first run is cold.
+--warm runs twice and reports the second, incremental run. Worker processes replay the same cassette and their
+requests, bytes and parse time are counted with the main process's through metrics. The report is printed as JSON.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import api  # noqa: E402
+import metrics  # noqa: E402
+import recequip  # noqa: E402
+import util  # noqa: E402
+
+
+@contextlib.contextmanager
+def redirected(log):
+    """Send the output of this process and the worker processes it starts to log."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        os.close(saved[0])
+        os.close(saved[1])
+
+
+def run_once(log) -> dict:
+    # worker processes send their metrics back with each activity, so these cover them too
+    metrics.enabled = True
+    metrics.reset()
+    start = time.perf_counter()
+    with redirected(log):
+        recequip.run()
+    wall_seconds = time.perf_counter() - start
+    report = metrics.report()
+    return {
+        "requests": int(report["counters"].get("http.requests", 0)),
+        "bytes": int(report["counters"].get("http.bytes", 0)),
+        "parse_seconds": report["histograms"].get("parse.seconds", {}).get("total", 0.0),
+        "wall_seconds": wall_seconds,
+    }
+
+
+def reset():
+    """Forget everything a previous run in this process kept in memory, as if it was a new process."""
+    api.set_run_state({
+        **api.get_run_state(), "pages": {}, "dirty": set(), "fresh": set(), "missing": set(), "categories": {},
+        "aliases": {}, "stored_aliases": {},
+    })
+    # read stored pages from the cache database again on first use
+    api._page_store = None
+    for memo in util._memo.values():
+        memo.clear()
+    recequip.itemCache.clear()
+    recequip.itemDeps.clear()
+    recequip.missingCache.clear()
+    recequip.checkedItems.clear()
+    recequip.missingItems.clear()
+    recequip.inflightItems.clear()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["record", "run"])
+    parser.add_argument("cassette")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every replayed request")
+    parser.add_argument("--warm", action="store_true", help="report a second run on the caches of a first one")
+    parser.add_argument("--processes", type=int, default=1, help="recequip.processes")
+    parser.add_argument("--log", help="file for the scraper's own output")
+    args = parser.parse_args()
+    if args.mode == "record" and args.processes > 1:
+        # worker processes would send their requests past the recording
+        parser.error("record with --processes 1")
+
+    cassette = os.path.abspath(args.cassette)
+    recequip.processes = args.processes
+    with tempfile.TemporaryDirectory() as work, open(args.log or os.devnull, "w", encoding="utf-8") as log:
+        shutil.copy(ROOT / "data_to_import.csv", work)
+        open(os.path.join(work, "items_that_need_special_handling.txt"), "w").close()
+        os.chdir(work)
+        if args.mode == "record":
+            with api.recording(cassette):
+                # the second run records the revalidation requests of a warm run
+                runs = [run_once(log)]
+                reset()
+                runs.append(run_once(log))
+        else:
+            with api.replaying(cassette, args.latency):
+                runs = [run_once(log)]
+                if args.warm:
+                    reset()
+                    runs.append(run_once(log))
+        with open(os.path.join("recs", "all.json"), "rb") as fi:
+            output_bytes = len(fi.read())
+
+    main_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # the worker processes have all been waited for once their pool shut down
+    worker_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    report = {
+        "mode": args.mode,
+        "run": "warm" if len(runs) > 1 else "cold",
+        "latency": args.latency,
+        "processes": args.processes,
+        **runs[-1],
+        # the main process plus the largest worker process
+        "peak_rss_mb": (main_rss + worker_rss) / 1024,
+        "worker_peak_rss_mb": worker_rss / 1024,
+        "output_bytes": output_bytes,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,314 +1,95 @@
 #!/usr/bin/env python3
-"""Build bulk variant_ids.json entries; merge with existing Elidinis/Ava's/Rune pouch rows."""
+"""Build bulk variant_ids.json families from scripts/variant_families.json; keep the existing hand-written edges (Elidinis/Ava's/Rune pouch).
+
+    python scripts/build_bulk_variant_ids.py [spec]
+
+Each family in the spec lists the wiki pages whose Infobox Item IDs it merges. A family with a "for" mapping is
+repeated for every combination of its values, substituted into "{placeholders}" of its name, note and titles, and
+"first_id_only" keeps only the first ID of each page. All pages are read through api.get_pages, 50 titles per
+request and concurrently, and shared with the scraper's page cache in wiki.cache.db, so a rebuild only downloads
+pages edited since they were last read.
+"""
 from __future__ import annotations
 
 import json
-import re
 import sys
-import urllib.parse
-import urllib.request
+from itertools import product
 from pathlib import Path
 
-UA = "recequip-wiki-scraper/1.0"
 ROOT = Path(__file__).resolve().parents[1]
 VARIANT_PATH = ROOT / "variant_ids.json"
-
-
-def wiki_ids(title: str) -> list[int]:
-    url = (
-        "https://oldschool.runescape.wiki/api.php?action=parse&prop=wikitext&format=json&page="
-        + urllib.parse.quote(title.replace(" ", "_"))
-    )
-    req = urllib.request.Request(url, headers={"User-Agent": UA})
-    with urllib.request.urlopen(req, timeout=45) as r:
-        d = json.loads(r.read().decode())
-    if "error" in d:
-        raise RuntimeError(d["error"].get("info", str(d["error"])))
-    t = d["parse"]["wikitext"]["*"]
-    idx = t.find("{{Infobox Item")
-    chunk = t[idx : idx + 35000] if idx >= 0 else t[:35000]
-    return sorted({int(m.group(1)) for m in re.finditer(r"\|id\d*\s*=\s*(\d+)", chunk)})
-
-
-def peer_entries(name: str, family: list[int], note: str) -> list[dict]:
-    s = sorted(set(family))
-    out = []
-    for bid in s:
-        extra = [x for x in s if x != bid]
-        out.append({"base_id": bid, "name": name, "note": note, "extra_ids": extra})
-    return out
+SPEC_PATH = Path(__file__).resolve().parent / "variant_families.json"
+
+sys.path.insert(0, str(ROOT))
+import api  # noqa: E402
+import cachedb  # noqa: E402
+import util  # noqa: E402
+
+
+def load_spec(path: Path) -> list[dict]:
+    families: list[dict] = []
+    for spec in json.loads(path.read_text(encoding="utf-8"))["families"]:
+        loops = spec.get("for", {})
+        for values in product(*loops.values()):
+            fields = dict(zip(loops, values))
+            families.append({
+                "name": spec["name"].format(**fields),
+                "note": spec["note"].format(**fields),
+                "titles": [title.format(**fields) for title in spec["titles"]],
+                "first_id_only": spec.get("first_id_only", False),
+            })
+    return families
+
+
+def wiki_ids(titles: list[str]) -> dict[str, list[int]]:
+    pages = api.get_pages(titles)
+    missing = [title for title in titles if title not in pages]
+    if missing:
+        raise SystemExit(f"Missing wiki pages: {', '.join(missing)}")
+    ids = {title: sorted(set(util.get_infobox_item_ids(title, pages[title]))) for title in titles}
+    for title in titles:
+        if not ids[title]:
+            print(f"No infobox IDs on {title}", file=sys.stderr)
+    return ids
+
+
+def family_entry(name: str, family: list[int], note: str) -> dict:
+    return {"name": name, "note": note, "ids": sorted(set(family))}
+
+
+def build_families(specs: list[dict]) -> list[dict]:
+    ids = wiki_ids(list(dict.fromkeys(title for spec in specs for title in spec["titles"])))
+    families: list[dict] = []
+    for spec in specs:
+        family = [i for title in spec["titles"] for i in (ids[title][:1] if spec["first_id_only"] else ids[title])]
+        if not family:
+            raise SystemExit(f"No IDs found for family {spec['name']}")
+        families.append(family_entry(spec["name"], family, spec["note"]))
+    return families
 
 
 def main() -> None:
-    entries: list[dict] = []
-
-    slayer = wiki_ids("Slayer helmet (i)")
-    entries.extend(peer_entries("Slayer helmet (i)", slayer, "Recolor variants (all Slayer helmet (i) IDs)"))
-
-    black = wiki_ids("Black mask (i)")
-    entries.extend(peer_entries("Black mask (i)", black, "Recolor variants (all Black mask (i) IDs)"))
-
-    suffixes = [
-        None,
-        "Agility Arena",
-        "Adventurer",
-        "Varlamore",
-        "Trailblazer",
-        "Hosidius",
-        "Shayzien",
-        "Arceuus",
-        "Lovakengj",
-        "Hallowed",
-        "Piscarilius",
-        "Kourend",
-    ]
-    slots = ["hood", "cape", "top", "legs", "gloves", "boots"]
-    for slot in slots:
-        fam: set[int] = set()
-        for suf in suffixes:
-            title = f"Graceful {slot}" if suf is None else f"Graceful {slot} ({suf})"
-            fam.update(wiki_ids(title))
-        entries.extend(
-            peer_entries(
-                f"Graceful {slot}",
-                list(fam),
-                "All graceful kit/recolor variants for this slot (wiki infobox IDs)",
-            )
-        )
-
-    bowfa = wiki_ids("Bow of faerdhinen") + wiki_ids("Bow of faerdhinen (c)")
-    entries.extend(peer_entries("Bow of faerdhinen", bowfa, "Inactive/active + corrupted (c)"))
-
-    blade = wiki_ids("Blade of saeldor") + wiki_ids("Blade of saeldor (c)")
-    entries.extend(peer_entries("Blade of saeldor", blade, "Inactive/active + corrupted (c)"))
-
-    crystal_helm: list[int] = []
-    crystal_body: list[int] = []
-    crystal_legs: list[int] = []
-    for clan in ["Amlodd", "Cadarn", "Crwys", "Hefin", "Iorwerth", "Ithell", "Trahaearn", "deadman"]:
-        crystal_helm.extend(wiki_ids(f"Crystal helm ({clan})"))
-        crystal_body.extend(wiki_ids(f"Crystal body ({clan})"))
-        crystal_legs.extend(wiki_ids(f"Crystal legs ({clan})"))
-    crystal_helm = wiki_ids("Crystal helm") + crystal_helm
-    crystal_body = wiki_ids("Crystal body") + crystal_body
-    crystal_legs = wiki_ids("Crystal legs") + crystal_legs
-    entries.extend(peer_entries("Crystal helm", crystal_helm, "Base + inactive + all elven recolors + deadman"))
-    entries.extend(peer_entries("Crystal body", crystal_body, "Base + inactive + all elven recolors + deadman"))
-    entries.extend(peer_entries("Crystal legs", crystal_legs, "Base + inactive + all elven recolors + deadman"))
-
-    cuisse = wiki_ids("Proselyte cuisse")[0]
-    tasset = wiki_ids("Proselyte tasset")[0]
-    entries.append(
-        {
-            "base_id": cuisse,
-            "name": "Proselyte cuisse",
-            "note": "Equivalent leg slot: Proselyte tasset (skirt)",
-            "extra_ids": [tasset],
-        }
-    )
-    entries.append(
-        {
-            "base_id": tasset,
-            "name": "Proselyte tasset",
-            "note": "Equivalent leg slot: Proselyte cuisse (platelegs)",
-            "extra_ids": [cuisse],
-        }
-    )
-
-    claws = wiki_ids("Dragon claws") + wiki_ids("Dragon claws (or)") + wiki_ids("Dragon claws (cr)")
-    entries.extend(peer_entries("Dragon claws", claws, "Normal + ornament (or) + Bounty Hunter (cr)"))
-
-    bh_cr = [
-        "Dragon dagger",
-        "Dragon battleaxe",
-        "Dragon boots",
-        "Dragon chainbody",
-        "Dragon crossbow",
-        "Dragon halberd",
-        "Dragon mace",
-        "Dragon warhammer",
-        "Dragon 2h sword",
-    ]
-    bh_bh = [
-        ("Dark bow", "Dark bow (bh)"),
-        ("Barrelchest anchor", "Barrelchest anchor (bh)"),
-        ("Abyssal dagger", "Abyssal dagger (bh)"),
-    ]
-    for base in bh_cr:
-        cr_title = f"{base} (cr)"
-        fam = sorted(set(wiki_ids(base) + wiki_ids(cr_title)))
-        entries.extend(peer_entries(base, fam, f"Base + {cr_title} (Bounty Hunter cosmetic)"))
-    for base, bh_title in bh_bh:
-        fam = sorted(set(wiki_ids(base) + wiki_ids(bh_title)))
-        entries.extend(peer_entries(base, fam, f"Base + {bh_title} (Bounty Hunter cosmetic)"))
-
-    # Tools / leagues variants present in recs
-    dp = wiki_ids("Dragon pickaxe") + wiki_ids("Dragon pickaxe (or)")
-    entries.extend(peer_entries("Dragon pickaxe", dp, "Base + Dragon pickaxe (or) ornament"))
-
-    inf = wiki_ids("Infernal axe") + wiki_ids("Infernal axe (or)")
-    entries.extend(peer_entries("Infernal axe", inf, "Base + Infernal axe (or) ornament"))
-
-    cp = wiki_ids("Crystal pickaxe") + wiki_ids("Crystal pickaxe (The Gauntlet)") + wiki_ids("Echo pickaxe")
-    entries.extend(
-        peer_entries(
-            "Crystal pickaxe",
-            cp,
-            "Standard + Gauntlet + Echo (Leagues / community variants)",
-        )
-    )
-
-    # Torva + Sanguine torva (blood ornament)
-    entries.extend(
-        peer_entries(
-            "Torva full helm",
-            wiki_ids("Torva full helm") + wiki_ids("Sanguine torva full helm"),
-            "Torva + Sanguine torva (blood ornament) + all infobox versions",
-        )
-    )
-    entries.extend(
-        peer_entries(
-            "Torva platebody",
-            wiki_ids("Torva platebody") + wiki_ids("Sanguine torva platebody"),
-            "Torva + Sanguine torva (blood ornament) + all infobox versions",
-        )
-    )
-    entries.extend(
-        peer_entries(
-            "Torva platelegs",
-            wiki_ids("Torva platelegs") + wiki_ids("Sanguine torva platelegs"),
-            "Torva + Sanguine torva (blood ornament) + all infobox versions",
-        )
-    )
-
-    # Blood moon armour (recolors)
-    entries.extend(
-        peer_entries(
-            "Blood moon helm",
-            wiki_ids("Blood moon helm"),
-            "Blood moon armour recolors (all wiki infobox versions)",
-        )
-    )
-    entries.extend(
-        peer_entries(
-            "Blood moon chestplate",
-            wiki_ids("Blood moon chestplate"),
-            "Blood moon armour recolors (all wiki infobox versions)",
-        )
-    )
-    entries.extend(
-        peer_entries(
-            "Blood moon tassets",
-            wiki_ids("Blood moon tassets"),
-            "Blood moon armour recolors (all wiki infobox versions)",
-        )
-    )
-
-    # Oathplate + Radiant oathplate (white / purifying sigil cosmetic)
-    entries.extend(
-        peer_entries(
-            "Oathplate helm",
-            wiki_ids("Oathplate helm") + wiki_ids("Radiant oathplate helm"),
-            "Oathplate + Radiant oathplate (white) variant",
-        )
-    )
-    entries.extend(
-        peer_entries(
-            "Oathplate chest",
-            wiki_ids("Oathplate chest") + wiki_ids("Radiant oathplate chest"),
-            "Oathplate + Radiant oathplate (white) variant",
-        )
-    )
-    entries.extend(
-        peer_entries(
-            "Oathplate legs",
-            wiki_ids("Oathplate legs") + wiki_ids("Radiant oathplate legs"),
-            "Oathplate + Radiant oathplate (white) variant",
-        )
-    )
-
-    # Abyssal whip: base + LMS volcanic/frozen + Shattered relics (or)
-    entries.extend(
-        peer_entries(
-            "Abyssal whip",
-            wiki_ids("Abyssal whip")
-            + wiki_ids("Volcanic abyssal whip")
-            + wiki_ids("Frozen abyssal whip")
-            + wiki_ids("Abyssal whip (or)"),
-            "Base + Volcanic/Frozen (LMS Justine) + Abyssal whip (or) Shattered relics kit",
-        )
-    )
-    # Abyssal tentacle: base + Shattered (or) only (no volcanic/frozen tentacle items)
-    entries.extend(
-        peer_entries(
-            "Abyssal tentacle",
-            wiki_ids("Abyssal tentacle") + wiki_ids("Abyssal tentacle (or)"),
-            "Base + Abyssal tentacle (or) Shattered relics variety ornament kit",
-        )
-    )
-
-    # Void knight / Elite void: body/leg slots merge void+elite+(or). Three helms stay separate (melee/range/mage).
-    void_top = (
-        wiki_ids("Void knight top")
-        + wiki_ids("Elite void top")
-        + wiki_ids("Void knight top (or)")
-        + wiki_ids("Elite void top (or)")
-    )
-    entries.extend(
-        peer_entries(
-            "Void knight top / Elite void top",
-            void_top,
-            "Void + Elite + (or) Shattered relics void ornament; helms are separate families",
-        )
-    )
-    void_robe = (
-        wiki_ids("Void knight robe")
-        + wiki_ids("Elite void robe")
-        + wiki_ids("Void knight robe (or)")
-        + wiki_ids("Elite void robe (or)")
-    )
-    entries.extend(
-        peer_entries(
-            "Void knight robe / Elite void robe",
-            void_robe,
-            "Void + Elite + (or) Shattered relics void ornament; helms are separate families",
-        )
-    )
-    entries.extend(
-        peer_entries(
-            "Void knight gloves",
-            wiki_ids("Void knight gloves") + wiki_ids("Void knight gloves (or)"),
-            "Base + (or) Shattered relics void ornament kit",
-        )
-    )
-    for helm_name, note in [
-        ("Void melee helm", "Melee helm only + (or); not merged with ranger/mage helms"),
-        ("Void ranger helm", "Ranger helm only + (or); not merged with melee/mage helms"),
-        ("Void mage helm", "Mage helm only + (or); not merged with melee/ranger helms"),
-    ]:
-        entries.extend(
-            peer_entries(
-                helm_name,
-                wiki_ids(helm_name) + wiki_ids(helm_name + " (or)"),
-                note,
-            )
-        )
-
-    by_id: dict[int, dict] = {}
-    for e in entries:
-        by_id[e["base_id"]] = e
-
-    preserved = {22109, 12791, 25985, 27251}
+    spec_path = Path(sys.argv[1]) if len(sys.argv) > 1 else SPEC_PATH
+    # share the scraper's page cache wherever this is run from
+    cachedb.db_file = str(ROOT / cachedb.db_file)
+    try:
+        families = build_families(load_spec(spec_path))
+        api.save_page_store()
+    finally:
+        cachedb.close()
+
+    edges: list[dict] = []
     if VARIANT_PATH.is_file():
         existing = json.loads(VARIANT_PATH.read_text(encoding="utf-8"))
-        for e in existing:
-            bid = e["base_id"]
-            if bid in preserved:
-                by_id[bid] = e
+        if isinstance(existing, list):
+            raise SystemExit(f"{VARIANT_PATH} is in the old format, run scripts/convert_variant_ids.py first")
+        edges = existing.get("edges", [])
 
-    merged = sorted(by_id.values(), key=lambda x: x["base_id"])
-    VARIANT_PATH.write_text(json.dumps(merged, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
-    print(f"Wrote {len(merged)} entries to {VARIANT_PATH}", file=sys.stderr)
+    families.sort(key=lambda x: x["ids"][0])
+    VARIANT_PATH.write_text(
+        json.dumps({"families": families, "edges": edges}, indent=2, ensure_ascii=False) + "\n", encoding="utf-8"
+    )
+    print(f"Wrote {len(families)} families and {len(edges)} edges to {VARIANT_PATH}", file=sys.stderr)
 
 
 if __name__ == "__main__":
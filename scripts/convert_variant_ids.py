@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Convert variant_ids.json from per-base_id entries to families + edges.
+
+Entries whose IDs form a complete family (every member lists every other member, ascending) become one
+family; everything else is kept as a one-way edge. The result is checked to expand to exactly the same
+lookup as the input before it is written.
+
+    python scripts/convert_variant_ids.py [path]
+"""
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import apply_variants  # noqa: E402
+
+
+def convert(entries: list[dict]) -> dict:
+    lookup = {e["base_id"]: e["extra_ids"] for e in entries}
+    families: list[dict] = []
+    edges: list[dict] = []
+    grouped: set[int] = set()
+    for e in entries:
+        bid = e["base_id"]
+        if bid in grouped:
+            continue
+        ids = sorted({bid, *e["extra_ids"]})
+        if all(lookup.get(x) == [y for y in ids if y != x] for x in ids):
+            family = {k: e[k] for k in ("name", "note") if k in e}
+            family["ids"] = ids
+            families.append(family)
+            grouped.update(ids)
+        else:
+            edges.append(e)
+    return {"families": families, "edges": edges}
+
+
+def main() -> None:
+    path = Path(sys.argv[1]) if len(sys.argv) > 1 else ROOT / "variant_ids.json"
+    entries = json.loads(path.read_text(encoding="utf-8"))
+    if not isinstance(entries, list):
+        print(f"{path} is already in the families + edges format", file=sys.stderr)
+        return
+    before = apply_variants.load_variant_ids(str(path))
+    converted = convert(entries)
+    after = apply_variants.expand_variant_families(
+        [f["ids"] for f in converted["families"]], apply_variants.load_edges(converted["edges"], str(path))
+    )
+    if list(before.items()) != list(sorted(before.items())) or before != after:
+        print("Conversion would change the expanded lookup, not writing", file=sys.stderr)
+        sys.exit(1)
+    path.write_text(json.dumps(converted, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+    print(
+        f"Wrote {len(converted['families'])} families and {len(converted['edges'])} edges to {path}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
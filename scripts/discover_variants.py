@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Propose variant families for the items in recs/all.json and print them as a diff against variant_ids.json.
+
+    python scripts/discover_variants.py [--write] [CATEGORY ...]   # Items by default
+
+The pages of the categories are swept once through the item index (itemindex.refresh: member lists 500 titles per
+request, revision IDs 50 per request, and only new or edited pages downloaded and parsed), then families are
+proposed from the indexed titles and IDs alone:
+
+  - cosmetic suffixes and prefixes: "X (or)", "X (cr)", "X (bh)", "X (c)", "Sanguine x", "Radiant x", ...
+  - recolor sets: "X" with at least RECOLOR_MIN pages named "X (kit)" for non-numeric kits, e.g. Graceful pieces
+  - Infobox Item versions: a page with several IDs of which recs/all.json lists only some together
+
+Only families with an ID in recs/all.json are kept. A proposal inside an existing family is dropped, one that
+overlaps existing families extends them, the rest are added. The resulting variant_ids.json is printed as a unified
+diff for review, or written with --write.
+"""
+from __future__ import annotations
+
+import argparse
+import difflib
+import json
+import re
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+VARIANT_PATH = ROOT / "variant_ids.json"
+ALL_JSON_PATH = ROOT / "recs" / "all.json"
+
+sys.path.insert(0, str(ROOT))
+import api  # noqa: E402
+import cachedb  # noqa: E402
+import itemindex  # noqa: E402
+
+# "X (suffix)" pages that are cosmetic variants of "X"
+COSMETIC_SUFFIXES = ["or", "cr", "bh", "c", "g", "t"]
+# "Prefix x" pages that are cosmetic variants of "X"
+COSMETIC_PREFIXES = ["Sanguine", "Radiant", "Volcanic", "Frozen"]
+# "X" with at least this many "X (kit)" pages is a recolor set
+RECOLOR_MIN = 3
+
+SUFFIXED = re.compile(r"^(.+) \(([^()]+)\)$")
+SLOT_KEYS = ["head", "neck", "cape", "body", "legs", "weapon", "shield", "ammo", "hands", "feet", "ring", "special"]
+
+
+def load_recs(path: Path) -> set[frozenset[int]]:
+    entries: set[frozenset[int]] = set()
+    for activity in json.loads(path.read_text(encoding="utf-8")):
+        for style in activity["styles"]:
+            for slot in SLOT_KEYS:
+                for item in style.get(slot, []):
+                    entries.update(frozenset(item_ids) for item_ids in item.values())
+    return entries
+
+
+def propose(index: dict[str, list[int]], rec_entries: set[frozenset[int]]) -> list[dict]:
+    variants: dict[str, dict[str, str]] = defaultdict(dict)
+    recolors: dict[str, list[str]] = defaultdict(list)
+    for title in index:
+        match = SUFFIXED.match(title)
+        if match and match[1] in index:
+            if match[2] in COSMETIC_SUFFIXES:
+                variants[match[1]][title] = f"({match[2]})"
+            elif not match[2].isdigit():
+                recolors[match[1]].append(title)
+        first, _, rest = title.partition(" ")
+        base = rest[:1].upper() + rest[1:]
+        if first in COSMETIC_PREFIXES and base in index:
+            variants[base][title] = first
+    for base, titles in recolors.items():
+        if len(titles) >= RECOLOR_MIN:
+            variants[base].update((title, "recolor") for title in titles)
+
+    families: list[dict] = []
+    for base, members in variants.items():
+        kinds = ", ".join(sorted(set(members.values())))
+        families.append({
+            "name": base,
+            "note": f"Discovered: base + {kinds} variants ({', '.join(members)})",
+            "ids": sorted({i for title in [base, *members] for i in index[title]}),
+        })
+    by_id: dict[int, list[frozenset[int]]] = defaultdict(list)
+    for entry in rec_entries:
+        for i in entry:
+            by_id[i].append(entry)
+    for title, ids in index.items():
+        versions = set(ids)
+        if len(versions) > 1 and title not in variants and any(
+                not versions <= entry for i in versions for entry in by_id[i]):
+            families.append({"name": title, "note": "Discovered: all Infobox Item versions", "ids": sorted(versions)})
+    return families
+
+
+def merge(existing: dict, proposals: list[dict], rec_ids: set[int]) -> tuple[dict, list[str]]:
+    families = [dict(family, ids=list(family["ids"])) for family in existing.get("families", [])]
+    changes: list[str] = []
+    for proposal in proposals:
+        ids = set(proposal["ids"])
+        if len(ids) < 2 or not ids & rec_ids:
+            continue
+        overlapping = [family for family in families if ids & set(family["ids"])]
+        if any(ids <= set(family["ids"]) for family in overlapping):
+            continue
+        if overlapping:
+            for family in overlapping:
+                added = sorted(ids - set(family["ids"]))
+                family["ids"] = sorted(set(family["ids"]) | ids)
+                changes.append(f"extend {family.get('name', family['ids'][0])}: +{added}")
+        else:
+            families.append(proposal)
+            changes.append(f"add {proposal['name']}: {proposal['ids']}")
+    families.sort(key=lambda x: x["ids"][0])
+    return {"families": families, "edges": existing.get("edges", [])}, changes
+
+
+def dump(data: dict) -> str:
+    return json.dumps(data, indent=2, ensure_ascii=False) + "\n"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("categories", nargs="*", default=itemindex.categories, help="item categories to sweep")
+    parser.add_argument("--write", action="store_true", help="write variant_ids.json instead of printing a diff")
+    args = parser.parse_args()
+
+    current = VARIANT_PATH.read_text(encoding="utf-8")
+    existing = json.loads(current)
+    if isinstance(existing, list):
+        raise SystemExit(f"{VARIANT_PATH} is in the old format, run scripts/convert_variant_ids.py first")
+    rec_entries = load_recs(ALL_JSON_PATH)
+
+    # share the scraper's page cache and item index wherever this is run from
+    cachedb.db_file = str(ROOT / cachedb.db_file)
+    try:
+        counts = itemindex.refresh(args.categories)
+        titles = list(dict.fromkeys(title for name in args.categories for title in api.get_category_members(name)))
+        index = {title: ids for title, (_, ids) in cachedb.get_item_index(titles).items() if ids}
+    finally:
+        cachedb.close()
+    print(f"Swept {len(titles)} pages ({counts['indexed']} parsed), {len(index)} with item IDs", file=sys.stderr)
+
+    proposed, changes = merge(existing, propose(index, rec_entries), set().union(*rec_entries))
+    for change in changes:
+        print(change, file=sys.stderr)
+    if args.write:
+        VARIANT_PATH.write_text(dump(proposed), encoding="utf-8")
+        print(f"Wrote {len(changes)} changes to {VARIANT_PATH}", file=sys.stderr)
+    else:
+        sys.stdout.writelines(difflib.unified_diff(
+            current.splitlines(keepends=True), dump(proposed).splitlines(keepends=True),
+            str(VARIANT_PATH.relative_to(ROOT)), "proposed",
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,22 @@
-"""One-off: fetch Graceful piece infobox IDs from OSRS wiki (requires User-Agent)."""
-import json
-import re
-import urllib.parse
-import urllib.request
+"""One-off: print the Graceful piece infobox IDs from the OSRS wiki, per page and per slot, as listed in scripts/variant_families.json."""
 
-UA = "recequip-wiki-scraper/1.0"
-SUFFIXES = [
-    None,
-    "Agility Arena",
-    "Adventurer",
-    "Varlamore",
-    "Trailblazer",
-    "Hosidius",
-    "Shayzien",
-    "Arceuus",
-    "Lovakengj",
-    "Hallowed",
-    "Piscarilius",
-    "Kourend",
-]
-SLOTS = ["hood", "cape", "top", "legs", "gloves", "boots"]
-
-
-def title_for(slot: str, suffix: str | None) -> str:
-    if suffix is None:
-        return f"Graceful {slot}"
-    return f"Graceful {slot} ({suffix})"
-
-
-def infobox_ids(wikitext: str) -> list[int]:
-    idx = wikitext.find("{{Infobox Item")
-    chunk = wikitext[idx : idx + 30000] if idx >= 0 else wikitext[:30000]
-    return sorted({int(m.group(1)) for m in re.finditer(r"\|id\d*\s*=\s*(\d+)", chunk)})
-
-
-def fetch(title: str) -> list[int]:
-    url = (
-        "https://oldschool.runescape.wiki/api.php?action=parse&prop=wikitext&format=json&page="
-        + urllib.parse.quote(title.replace(" ", "_"))
-    )
-    req = urllib.request.Request(url, headers={"User-Agent": UA})
-    with urllib.request.urlopen(req, timeout=30) as r:
-        d = json.loads(r.read().decode())
-    return infobox_ids(d["parse"]["wikitext"]["*"])
+import build_bulk_variant_ids as bulk
 
 
 def main() -> None:
-    by_slot: dict[str, set[int]] = {s: set() for s in SLOTS}
-    for slot in SLOTS:
-        for suf in SUFFIXES:
-            t = title_for(slot, suf)
-            try:
-                ids = fetch(t)
-                by_slot[slot].update(ids)
-                print(t, ids)
-            except Exception as e:
-                print(t, "ERROR", e)
+    families = [f for f in bulk.load_spec(bulk.SPEC_PATH) if f["name"].startswith("Graceful ")]
+    bulk.cachedb.db_file = str(bulk.ROOT / bulk.cachedb.db_file)
+    try:
+        ids = bulk.wiki_ids([title for f in families for title in f["titles"]])
+        bulk.api.save_page_store()
+    finally:
+        bulk.cachedb.close()
+    for f in families:
+        for t in f["titles"]:
+            print(t, ids[t])
     print("--- UNION PER SLOT ---")
-    for slot in SLOTS:
-        print(slot, sorted(by_slot[slot]))
+    for f in families:
+        print(f["name"].split(" ", 1)[1], sorted({i for t in f["titles"] for i in ids[t]}))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+"""apply_variants' indexed expansion against the nested loop over per-base_id entries it replaced."""
+
+import copy
+import json
+import sys
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import apply_variants  # noqa: E402
+
+
+def old_entries(data: dict) -> list[dict]:
+    """old_entries is variant_ids.json in the older format, one entry per family member and edge"""
+    entries = [
+        {"base_id": base_id, "extra_ids": [x for x in sorted(family["ids"]) if x != base_id]}
+        for family in data["families"] for base_id in family["ids"]
+    ]
+    return entries + data["edges"]
+
+
+def old_lookup(entries: list[dict]) -> dict[int, list[int]]:
+    lookup: dict[int, list[int]] = {}
+    for entry in entries:
+        # a later entry for the same base_id was ignored
+        lookup.setdefault(entry["base_id"], list(entry["extra_ids"]))
+    return lookup
+
+
+def old_apply(styles: list, lookup: dict[int, list[int]]) -> None:
+    """old_apply is the expansion before build_variant_index, one pass over every entry per item"""
+    for style in styles:
+        for slot_key in apply_variants.SLOT_KEYS:
+            for tier_dict in style.get(slot_key, []):
+                for item_name, item_ids in tier_dict.items():
+                    for base_id, extra_ids in lookup.items():
+                        if base_id in item_ids:
+                            merged, added = apply_variants.merge_ids(item_ids, extra_ids)
+                            if added:
+                                tier_dict[item_name] = merged
+
+
+def first_ids_only(activities: list) -> list:
+    stripped = copy.deepcopy(activities)
+    for activity in stripped:
+        for style in activity["styles"]:
+            for slot_key in apply_variants.SLOT_KEYS:
+                for tier_dict in style.get(slot_key, []):
+                    for item_name, item_ids in tier_dict.items():
+                        tier_dict[item_name] = item_ids[:1]
+    return stripped
+
+
+class VariantIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(apply_variants.VARIANT_IDS_PATH, encoding="utf-8") as f:
+            cls.data = json.load(f)
+        with open(apply_variants.ALL_JSON_PATH, encoding="utf-8") as f:
+            cls.recs = json.load(f)
+        cls.lookup = apply_variants.load_variant_ids(apply_variants.VARIANT_IDS_PATH)
+        cls.old = old_lookup(old_entries(cls.data))
+
+    def expand(self, activities: list, lookup: dict[int, list[int]]) -> list:
+        expanded = copy.deepcopy(activities)
+        index = apply_variants.build_variant_index(lookup)
+        for activity in expanded:
+            apply_variants.apply_variants_to_styles(activity["styles"], lookup, activity["name"], index)
+        return expanded
+
+    def test_lookup_matches_old_entries(self):
+        self.assertEqual(self.lookup, self.old)
+        self.assertEqual(list(self.lookup), sorted(self.lookup))
+
+    def test_recs_match_old_loop(self):
+        for name, activities in [("all.json", self.recs), ("first ids only", first_ids_only(self.recs))]:
+            with self.subTest(name):
+                expected = copy.deepcopy(activities)
+                for activity in expected:
+                    old_apply(activity["styles"], self.old)
+                expanded = self.expand(activities, self.lookup)
+                self.assertEqual(expanded, expected)
+                self.assertEqual(self.expand(expanded, self.lookup), expanded)
+
+    def test_every_matching_entry_is_applied(self):
+        # the old loop merged each entry into the original list, so only the last one that added ids was kept
+        lookup = {1: [10], 2: [20]}
+        styles = [{"name": "Melee", "head": [{"Item": [1, 2]}]}]
+        old_styles = copy.deepcopy(styles)
+        old_apply(old_styles, lookup)
+        self.assertEqual(old_styles[0]["head"][0]["Item"], [1, 2, 20])
+        patches = apply_variants.apply_variants_to_styles(styles, lookup, "Test")
+        self.assertEqual(styles[0]["head"][0]["Item"], [1, 2, 10, 20])
+        self.assertEqual(patches, [("Item", "head", [10]), ("Item", "head", [20])])
+
+    def test_overlapping_families_are_merged(self):
+        # per-base_id entries kept the first entry of an id, so the second family and the edge were dropped
+        data = {"families": [{"ids": [1, 2]}, {"ids": [2, 3]}], "edges": [{"base_id": 3, "extra_ids": [4]}]}
+        self.assertEqual(old_lookup(old_entries(data)), {1: [2], 2: [1], 3: [2]})
+        lookup = apply_variants.expand_variant_families(
+            [family["ids"] for family in data["families"]], apply_variants.load_edges(data["edges"], "test"))
+        self.assertEqual(lookup, {1: [2, 3], 2: [1, 3], 3: [1, 2, 4]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""Items, negative results and activities read from the cache database as they are needed."""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import cachedb  # noqa: E402
+import recequip  # noqa: E402
+
+
+class CacheDbTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.enterContext(mock.patch.object(cachedb, "db_file", os.path.join(tmp.name, "wiki.cache.db")))
+        self.addCleanup(cachedb.close)
+
+    def test_items(self):
+        cachedb.save_negatives("item", {"Foo": {"Foo": 1}, "Bar": {"Bar": 1}})
+        cachedb.save_items({"Foo": [1, 2], "Baz": [3]}, {"Foo": {"Foo": 2}})
+        self.assertEqual(cachedb.get_items(["Foo", "Baz", "Bar"]), {"Foo": ([1, 2], {"Foo": 2}), "Baz": ([3], None)})
+        # found now, so no longer missing
+        self.assertEqual(cachedb.get_negatives("item", ["Foo", "Bar"]), {"Bar": {"Bar": 1}})
+        cachedb.delete_items(["Baz"])
+        self.assertEqual(list(cachedb.get_items(["Foo", "Baz"])), ["Foo"])
+        cachedb.drop_items()
+        self.assertEqual(cachedb.get_items(["Foo"]), {})
+        self.assertEqual(cachedb.get_negatives("item", ["Bar"]), {})
+
+    def test_unchanged_negatives_keep_checked_at(self):
+        cachedb.save_negatives("item", {"Foo": {"Foo": 1}, "Bar": {"Bar": 1}})
+        checked = dict(cachedb.connect().execute("SELECT key, checked_at FROM negatives"))
+        time.sleep(0.01)
+        cachedb.save_negatives("item", {"Foo": {"Foo": 1}, "Bar": {"Bar": 2}})
+        rechecked = dict(cachedb.connect().execute("SELECT key, checked_at FROM negatives"))
+        self.assertEqual(rechecked["Foo"], checked["Foo"])
+        self.assertGreater(rechecked["Bar"], checked["Bar"])
+
+    def test_activities_with_styles(self):
+        cachedb.save_activities("v", {"A": {"A": 1}, "B": {"B": 1}, "C": {"C": 1}}, {"A": "[]", "C": "[]"})
+        self.assertEqual(cachedb.get_activities(["A", "B"]), {"A": {"A": 1}})
+        self.assertEqual(cachedb.load_activity_styles(["A", "B", "C"]), {"A": "[]", "C": "[]"})
+
+
+class LoadStoredItemsTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.enterContext(mock.patch.object(cachedb, "db_file", os.path.join(tmp.name, "wiki.cache.db")))
+        self.addCleanup(cachedb.close)
+        for name, value in [("itemCache", {}), ("itemDeps", {}), ("missingCache", {}), ("checkedItems", set()),
+                            ("storedItems", True), ("incremental", True)]:
+            self.enterContext(mock.patch.object(recequip, name, value))
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        cachedb.save_items({"Current": [1], "Edited": [2]}, {"Current": {"Current": 5}, "Edited": {"Edited": 5}})
+        cachedb.save_negatives("item", {"Missing": {"Missing": 5}})
+        self.versions = self.enterContext(mock.patch.object(
+            recequip.api, "get_versions", return_value={"Current": 5, "Edited": 6, "Missing": 5}))
+
+    def test_only_unchanged_items_are_kept(self):
+        recequip.load_stored_items(["Current", "Edited", "Missing", "Unknown"])
+        self.assertEqual(recequip.itemCache, {"Current": [1]})
+        self.assertEqual(recequip.itemDeps, {"Current": {"Current": 5}})
+        self.assertEqual(recequip.missingCache, {"Missing": {"Missing": 5}})
+        # one batch for all of them
+        self.versions.assert_called_once()
+
+    def test_items_are_read_once(self):
+        recequip.load_stored_items(["Edited"])
+        recequip.load_stored_items(["Edited", "Current"])
+        self.assertEqual(recequip.itemCache, {"Current": [1]})
+        self.assertEqual(self.versions.call_count, 2)
+        self.assertEqual([list(call.args[0]) for call in self.versions.call_args_list], [["Edited"], ["Current"]])
+
+    def test_not_read_after_scraper_change(self):
+        recequip.storedItems = False
+        recequip.load_stored_items(["Current"])
+        self.assertEqual(recequip.itemCache, {})
+        self.versions.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+"""The compact export and its compressed siblings against the all.json they are written from."""
+
+import gzip
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import export  # noqa: E402
+
+
+class CompactExportTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(ROOT / "recs" / "all.json", encoding="utf-8") as f:
+            cls.recs = json.load(f)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def test_compact_round_trips(self):
+        self.assertEqual(export.expand_compact(export.compact_activities(self.recs)), self.recs)
+
+    def test_streamed_matches_compact_activities(self):
+        path = os.path.join(self.dir, export.COMPACT_NAME)
+        with export.CompactWriter(path) as writer:
+            for activity in self.recs:
+                writer.append(activity)
+        with open(path, "rb") as fi:
+            data = fi.read()
+        self.assertEqual(data, json.dumps(export.compact_activities(self.recs), separators=(",", ":")).encode("utf-8"))
+        self.assertEqual(export.load_compact(path), self.recs)
+
+    def test_empty(self):
+        path = os.path.join(self.dir, export.COMPACT_NAME)
+        with export.CompactWriter(path):
+            pass
+        self.assertEqual(export.load_compact(path), [])
+
+    def test_failed_write_keeps_old_file(self):
+        path = os.path.join(self.dir, export.COMPACT_NAME)
+        with export.CompactWriter(path) as writer:
+            for activity in self.recs[:2]:
+                writer.append(activity)
+        with self.assertRaises(RuntimeError):
+            with export.CompactWriter(path) as writer:
+                writer.append(self.recs[2])
+                raise RuntimeError()
+        self.assertEqual(export.load_compact(path), self.recs[:2])
+        self.assertFalse([name for name in os.listdir(self.dir) if name.endswith(".tmp")])
+
+    def test_exports_of_all_min_json(self):
+        with open(os.path.join(self.dir, export.MIN_NAME), "w", encoding="utf-8") as f:
+            json.dump(self.recs, f, separators=(",", ":"))
+        export.write_exports(self.dir)
+        with gzip.open(os.path.join(self.dir, export.MIN_NAME + ".gz")) as f:
+            self.assertEqual(json.load(f), self.recs)
+        for name in (export.COMPACT_NAME, export.COMPACT_NAME + ".gz"):
+            with self.subTest(name):
+                self.assertEqual(export.load_compact(os.path.join(self.dir, name)), self.recs)
+
+
+if __name__ == "__main__":
+    unittest.main()
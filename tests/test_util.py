@@ -0,0 +1,130 @@
+"""Parity of util.scan_templates and the ids read through it with a full mwparserfromhell parse."""
+
+import contextlib
+import io
+import random
+import sys
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import mwparserfromhell  # noqa: E402
+
+import util  # noqa: E402
+
+DATA = Path(__file__).resolve().parent / "data"
+
+# name -> (wikitext, whether the scanner is expected to handle it rather than fall back)
+EDGE_CASES = {
+    "plain": ("{{Infobox Item|name=Foo|id=1}}", True),
+    "nested": ("{{Infobox Item|version1=A|id1={{Foo|2}}3|id2=4, 5|name={{Bar|{{Baz|x=1}} }} }}", True),
+    "positional after named": ("{{Plink|Foo|txt=bar|Baz}}", True),
+    "duplicate param": ("{{Infobox Item|id=1|id=2}}", True),
+    "whitespace": ("{{ infobox_Item \n| id1 = 1 , 2\n|id2= 3 \n}}", True),
+    "link with pipe": ("{{Infobox Item|name=[[Foo|bar=baz]]|id=1}}", True),
+    "link in name param": ("{{Plink|[[Foo]]|txt=[[Foo|bar]]}}", True),
+    "comment": ("{{Infobox Item|id=1<!-- , 2 -->|id2=3<!--|id3=4-->}}", True),
+    "comment in name": ("{{Infobox Item<!-- versions -->|id=1}}", False),
+    "equals in value": ("{{Infobox Item|examine=a=b|id=1=2}}", True),
+    "empty": ("{{Infobox Item}}{{Infobox Item|}}{{Infobox Item|id=}}", True),
+    "triple braces": ("{{Infobox Item|id={{{id|1}}}}}", False),
+    "triple braces in text": ("{{{1}}} {{Infobox Item|id=1}}", False),
+    "nowiki": ("{{Infobox Item|id=<nowiki>1</nowiki>,2}}", False),
+    "nowiki around template": ("<nowiki>{{Infobox Item|id=1}}</nowiki>{{Infobox Item|id=2}}", False),
+    "pre": ("<pre>{{Infobox Item|id=1}}</pre>", False),
+    "entity in name": ("{{Foo &amp; bar|x}}{{Plink|Foo &amp; bar}}", False),
+    "entity in value": ("{{Infobox Item|name=Foo &amp; bar|id=1}}", True),
+    "ref in value": ("{{Plink|Foo}}<ref>{{Plink|Bar}}</ref>{{Infobox Item|id=1<ref>x</ref>}}", False),
+    "table in template": ("{{Infobox Item|id=1|text=\n{|\n|a\n|}\n}}", False),
+    "external link": ("{{Infobox Item|id=1|source=[https://example.com x]}}", False),
+    "unclosed": ("{{Infobox Item|id=1", False),
+    "unclosed comment": ("{{Infobox Item|id=1}}<!-- {{Plink|x}}", False),
+    "stray closing": ("}} {{Infobox Item|id=1}} ]]", True),
+}
+
+FRAGMENTS = [
+    "{{Infobox Item|id={i}}}", "{{Infobox Item|version1=A|version2=B|id1={i}|id2={i}, {j}}}",
+    "{{Infobox Item|id={i}|id1={j}}}", "{{Infobox Item|version1=A|image1=x|id={i}}}",
+    "{{Plink|Item {i}}}", "{{plink|Item {i}|txt=[[Item {j}|x]]}}", "{{Foo|{{Bar|{i}}}|y={j}}}",
+    "[[Item {i}|y]]", "<!-- {{Plink|{j}}} -->", "text ", "\n", "|", "=", "[[File:{i}.png|20px]]",
+    "{{Infobox Item|id={i}<!-- {j} -->}}", "{{Infobox_item|id= {i} ,,{j}}}", "{{Infobox Item|id=x{i}}}",
+    "{{{{Plink|a}}}}", "<nowiki>{{Infobox Item|id={i}}}</nowiki>", "&amp;", "{{Infobox Item|id={{{1|{i}}}}}}",
+]
+
+
+def parsed(text: str):
+    return util.parsed_templates(mwparserfromhell.parse(text, skip_style_tags=True))
+
+
+def old_version_ids(source: str, text: str):
+    """old_version_ids is the per-version extraction recequip did before scan_templates"""
+    return [
+        (vid, util.get_ids_for_page(source + str(vid), version))
+        for vid, version in util.each_version("Infobox Item", mwparserfromhell.parse(text, skip_style_tags=True))
+    ]
+
+
+def new_version_ids(source: str, text: str):
+    return [
+        (vid, util.get_ids_for_page(source + str(vid), version))
+        for vid, version in util.scanned_versions("Infobox Item", util.get_templates(text))
+    ]
+
+
+def samples():
+    for path in sorted(DATA.glob("*.wikitext")):
+        yield path.stem, path.read_text(encoding="utf-8")
+    for name, (text, _) in EDGE_CASES.items():
+        yield name, text
+    rng = random.Random(5)
+    for n in range(300):
+        parts = [rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 8))]
+        yield f"random {n}", "".join(
+            part.replace("{i}", str(rng.randint(0, 30))).replace("{j}", str(rng.randint(0, 30))) for part in parts)
+
+
+class ScanTemplatesTest(unittest.TestCase):
+
+    def setUp(self):
+        for memo in util._memo.values():
+            memo.clear()
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def test_sample_pages_are_scanned(self):
+        for path in sorted(DATA.glob("*.wikitext")):
+            with self.subTest(path.name):
+                self.assertIsNotNone(util.scan_templates(path.read_text(encoding="utf-8")))
+
+    def test_edge_cases_scan_or_fall_back(self):
+        for name, (text, scanned) in EDGE_CASES.items():
+            with self.subTest(name):
+                self.assertEqual(util.scan_templates(text) is not None, scanned)
+
+    def test_scan_matches_parse(self):
+        for name, text in samples():
+            with self.subTest(name):
+                templates = util.scan_templates(text)
+                if templates is not None:
+                    self.assertEqual(templates, parsed(text))
+                self.assertEqual(util.get_templates(text), parsed(text))
+
+    def test_version_ids_match_parse(self):
+        for name, text in samples():
+            with self.subTest(name):
+                old = old_version_ids(name, text)
+                self.assertEqual(new_version_ids(name, text), old)
+                self.assertEqual(
+                    util.get_infobox_item_ids(name, text),
+                    [i for _, ids in old if ids is not None for i in ids])
+
+    def test_sample_ids(self):
+        self.assertEqual(util.get_infobox_item_ids("Ring of charos", (DATA / "ring_of_charos.wikitext").read_text()),
+            [4202, 6465])
+        # a numbered id hides the base one, like each_version always did
+        self.assertEqual(util.get_infobox_item_ids("God spells", (DATA / "god_spells.wikitext").read_text()),
+            [2415, 2416, 2418])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,13 +2,38 @@
 
 import json
 import re
-from typing import Dict, List, Optional, Tuple, Iterator, Any, Callable, cast
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Iterator, Iterable, Any, Callable, cast
+import mwparserfromhell as mw
 from mwparserfromhell.nodes.template import Parameter
 from mwparserfromhell.wikicode import Wikicode
 from mwparserfromhell.nodes import Template
 
+import metrics
+import output
+
 VERSION_EXTRACTOR = re.compile(r"(.*?)([0-9]+)?$")
 
+# A template as (normalized name, [(param name, raw value, showkey)])
+ScannedTemplate = Tuple[str, List[Tuple[str, str, bool]]]
+
+SCANNER_TOKENS = re.compile(r"\{\{|\}\}|\[\[|\]\]|\{\||\||=|<!--|<|\[")
+# tags whose contents mwparserfromhell does not parse as wikitext
+SCANNER_OPAQUE_TAGS = re.compile(
+    r"<\s*(nowiki|pre|math|source|syntaxhighlight|includeonly|noinclude|onlyinclude|gallery|imagemap|"
+    r"chem|ce|score|timeline|hiero|templatedata|graph|inputbox|categorytree|section)\b", re.IGNORECASE)
+SCANNER_EXTERNAL_LINK = re.compile(r"\[(?:https?:|ftp:|mailto:|//)", re.IGNORECASE)
+# names mwparserfromhell would not read as plain text; "&" may start an entity it decodes
+SCANNER_BAD_NAME = re.compile(r"[\[\]{}<>|\n&]")
+
+# How many parsed pages, template lists and id lists to keep, least recently used first out.
+# Parsed pages are far bigger than the rest so only a few of them are kept.
+MEMO_SIZES = {"parse": 32, "templates": 2048, "ids": 4096}
+_memo: Dict[str, "OrderedDict[Tuple[str, Optional[str], str], Any]"] = {kind: OrderedDict() for kind in MEMO_SIZES}
+_memoLock = threading.Lock()
+
 
 
 def each_version(templateName: str, code: Wikicode, includeBase: bool = False,
@@ -17,51 +42,248 @@ def each_version(templateName: str, code: Wikicode, includeBase: bool = False,
     each_version is a generator that yields each version of an infobox
     with variants, such as {{Infobox Item}} on [[Ring of charos]]
     """
-    if mergableKeys is None:
-        mergableKeys = ["version", "image", "caption"]
     infoboxes = filter_templates_by_name(templateName, code)
-    if len(infoboxes) < 1:
-        return
     for infobox in infoboxes:
-        base: Dict[str, Wikicode] = {}
-        versions: Dict[int, Dict[str, Wikicode]] = {}
-        for param in cast(List[Parameter], infobox.params):
-            matcher = VERSION_EXTRACTOR.match(str(param.name).strip())
-            if matcher is None:
-                raise AssertionError()
-            primary = matcher.group(1)
-            dic = base
-            if matcher.group(2) is not None:
-                version = int(matcher.group(2))
-                if version not in versions:
-                    versions[version] = {}
-                dic = versions[version]
-            dic[primary] = param.value
-        if len(versions) == 0:
+        params = ((str(param.name).strip(), param.value) for param in cast(List[Parameter], infobox.params))
+        yield from split_versions(params, includeBase, mergableKeys)
+
+
+def scanned_versions(templateName: str, templates: List[ScannedTemplate], includeBase: bool = False,
+    mergableKeys: List[str] | None = None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    scanned_versions is each_version over the output of scan_templates,
+    yielding raw string values instead of Wikicode
+    """
+    name = normalize_template_name(templateName)
+    for templateName, params in templates:
+        if templateName == name:
+            yield from split_versions(((key.strip(), value) for key, value, _ in params), includeBase, mergableKeys)
+
+
+def split_versions(params: Iterable[Tuple[str, Any]], includeBase: bool = False,
+    mergableKeys: List[str] | None = None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    split_versions sorts the (name, value) params of one infobox into
+    its base and numbered versions, yielding them as each_version does
+    """
+    if mergableKeys is None:
+        mergableKeys = ["version", "image", "caption"]
+    base: Dict[str, Any] = {}
+    versions: Dict[int, Dict[str, Any]] = {}
+    for name, value in params:
+        matcher = VERSION_EXTRACTOR.match(name)
+        if matcher is None:
+            raise AssertionError()
+        primary = matcher.group(1)
+        dic = base
+        if matcher.group(2) is not None:
+            version = int(matcher.group(2))
+            if version not in versions:
+                versions[version] = {}
+            dic = versions[version]
+        dic[primary] = value
+    if len(versions) == 0:
+        yield (-1, base)
+    else:
+        allMergable = True
+        for versionID, versionDict in versions.items():
+            for key in versionDict:
+                if not key in mergableKeys:
+                    allMergable = False
+        if allMergable:
             yield (-1, base)
         else:
-            allMergable = True
-            for versionID, versionDict in versions.items():
-                for key in versionDict:
-                    if not key in mergableKeys:
-                        allMergable = False
-            if allMergable:
+            if includeBase:
                 yield (-1, base)
-            else:
-                if includeBase:
-                    yield (-1, base)
-                for versionID, versionDict in versions.items():
-                    yield (versionID, {**base, **versionDict})
+            for versionID, versionDict in versions.items():
+                yield (versionID, {**base, **versionDict})
+
+
+def normalize_template_name(name: str) -> str:
+    """Normalize a template name the way Wikicode.matches compares them"""
+    name = name.strip()
+    return (name[0].upper() + name[1:]).replace("_", " ") if name else name
+
+
+def scan_templates(text: str) -> Optional[List[ScannedTemplate]]:
+    """
+    scan_templates finds every template on a page with a balanced brace
+    scan, in the order code.filter_templates() yields them, which is much
+    cheaper than a full mwparserfromhell parse. It returns None when the
+    page uses something it can't handle the same way mwparserfromhell
+    does (tags or tables inside templates, triple braces, nowiki and
+    friends), in which case the page should be parsed instead
+    """
+    if "{{{" in text or "}}}" in text or SCANNER_OPAQUE_TAGS.search(text):
+        return None
+    found: List[Tuple[int, ScannedTemplate]] = []
+    # open templates as [start, open links, [(param start, first "=")]]
+    stack: List[List[Any]] = []
+    pos = 0
+    while True:
+        match = SCANNER_TOKENS.search(text, pos)
+        if match is None:
+            break
+        token = match.group()
+        start = match.start()
+        pos = match.end()
+        if token == "<!--":
+            end = text.find("-->", pos)
+            if end < 0:
+                return None
+            pos = end + 3
+        elif not stack:
+            if token == "{{":
+                stack.append([start, 0, []])
+        elif token == "{{":
+            stack.append([start, 0, []])
+        elif token == "}}":
+            template = stack.pop()
+            if template[1]:
+                return None
+            scanned = _finish_template(text, template[0], start, template[2])
+            if scanned is None:
+                return None
+            found.append((template[0], scanned))
+        elif token == "[[":
+            close = text.find("]]", pos)
+            if close < 0 or "\n" in text[pos:close].split("|")[0]:
+                return None
+            stack[-1][1] += 1
+        elif token == "]]":
+            if stack[-1][1]:
+                stack[-1][1] -= 1
+        elif token == "|":
+            if not stack[-1][1]:
+                stack[-1][2].append([pos, -1])
+        elif token == "=":
+            params = stack[-1][2]
+            if not stack[-1][1] and params and params[-1][1] < 0:
+                if text[start - 1] == "\n":
+                    # could be a heading
+                    return None
+                params[-1][1] = start
+        elif token == "[":
+            if SCANNER_EXTERNAL_LINK.match(text, start):
+                return None
+        elif token == "<":
+            if text[pos:pos + 1].isalpha() or text[pos:pos + 1] == "/":
+                return None
+        else:
+            # "{|" opens a table
+            return None
+    if stack:
+        return None
+    found.sort(key=lambda template: template[0])
+    return [template for _, template in found]
+
+
+def _finish_template(text: str, start: int, end: int, params: List[List[int]]) -> Optional[ScannedTemplate]:
+    nameEnd = params[0][0] - 1 if params else end
+    name = text[start + 2:nameEnd]
+    if not name.strip() or SCANNER_BAD_NAME.search(name.strip()):
+        return None
+    scanned: List[Tuple[str, str, bool]] = []
+    positional = 1
+    for i, (paramStart, equals) in enumerate(params):
+        paramEnd = params[i + 1][0] - 1 if i + 1 < len(params) else end
+        if equals >= 0:
+            scanned.append((text[paramStart:equals], text[equals + 1:paramEnd], True))
+        else:
+            scanned.append((str(positional), text[paramStart:paramEnd], False))
+            positional += 1
+    return (normalize_template_name(name), scanned)
+
+
+def parsed_templates(code: Wikicode) -> List[ScannedTemplate]:
+    """parsed_templates gives the templates of parsed code in the shape scan_templates does"""
+    return [
+        (normalize_template_name(template.name.strip_code()),
+            [(str(param.name), str(param.value), param.showkey) for param in template.params])
+        for template in code.filter_templates()
+    ]
+
+
+def memoize(kind: str, text: str, section: Optional[str], extra: str, compute: Callable[[], Any]) -> Any:
+    """
+    memoize returns compute() for a page's wikitext, keeping the last
+    MEMO_SIZES[kind] results keyed by a hash of the text so a page that
+    is read again within the run isn't parsed again. Results are shared
+    and must not be modified
+    """
+    memo = _memo[kind]
+    key = (hashlib.sha1(text.encode("utf-8")).hexdigest(), section, extra)
+    with _memoLock:
+        if key in memo:
+            memo.move_to_end(key)
+            metrics.count(f"cache.{kind}.hit")
+            return memo[key]
+    metrics.count(f"cache.{kind}.miss")
+    value = compute()
+    with _memoLock:
+        memo[key] = value
+        memo.move_to_end(key)
+        while len(memo) > MEMO_SIZES[kind]:
+            memo.popitem(last=False)
+    return value
+
+
+def parse(text: str, section: Optional[str] = None) -> Wikicode:
+    """
+    parse returns the parsed wikitext of a page, or of its first section
+    matching section, memoized by the hash of the text
+    """
+    def compute() -> Wikicode:
+        with metrics.timer("parse.seconds"):
+            code = mw.parse(text, skip_style_tags=True)
+        if section is None:
+            return code
+        return code.get_sections(matches=section)[0]
+    return memoize("parse", text, section, "", compute)
+
+
+def get_templates(text: str, section: Optional[str] = None) -> List[ScannedTemplate]:
+    """
+    get_templates returns the templates on a page, or on one section of
+    it, scanning the wikitext and only falling back to a full parse when
+    the scanner can't handle it
+    """
+    def compute() -> List[ScannedTemplate]:
+        with metrics.timer("templates.seconds"):
+            templates = scan_templates(text) if section is None else None
+        if templates is None:
+            templates = parsed_templates(parse(text, section))
+        return templates
+    return memoize("templates", text, section, "", compute)
+
+
+def get_infobox_item_ids(source: str, text: str, section: Optional[str] = None) -> list[int]:
+    """
+    get_infobox_item_ids returns the ids of every version of every
+    {{Infobox Item}} on a page, the same way get_ids_for_page reads
+    each_version
+    """
+    return memoize("ids", text, section, source, lambda: get_ids_for_versions(
+        source, scanned_versions("Infobox Item", get_templates(text, section))))
+
+
+def get_ids_for_versions(source: str, versions: Iterable[Tuple[int, Dict[str, Any]]]) -> list[int]:
+    """get_ids_for_versions concatenates get_ids_for_page over each version"""
+    ids: list[int] = []
+    for (vid, version) in versions:
+        idsForVersion = get_ids_for_page(source + str(vid), version)
+        if idsForVersion is None:
+            continue
+        ids.extend(idsForVersion)
+    return ids
 
 
 def write_json(name: str | None, minName: str | None, data: dict[str, Any] | list[Any]):
-    """Write data to a JSON file"""
+    """Write data to a JSON file, leaving files that already hold the same JSON untouched"""
     if name is not None:
-        with open(name, "w+", encoding="utf-8") as fi:
-            json.dump(data, fi, indent=2)
+        output.write_text(name, json.dumps(data, indent=2))
     if minName is not None:
-        with open(minName, "w+", encoding="utf-8") as fi:
-            json.dump(data, fi, separators=(",", ":"))
+        output.write_text(minName, json.dumps(data, separators=(",", ":")))
 
 def get_ids_for_page(source: str, version: Dict[str, str]) -> list[int] | None:
     """mostly a copy of get_doc_for_id_string but just returning a list"""